@@ -1,3 +1,4 @@
+-- the original schema
 CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
@@ -25,5 +26,5 @@ CREATE TABLE Patients (
 	Username varchar(255) PRIMARY KEY,
 	Salt BINARY(16),
 	Hash BINARY(16),
-	apptID varchar(255),
-);
\ No newline at end of file
+	apptID varchar(255)
+);
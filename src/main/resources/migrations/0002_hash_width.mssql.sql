@@ -0,0 +1,4 @@
+-- versioned hashes carry their algorithm and settings, so they are longer than 16 bytes
+ALTER TABLE Caregivers ALTER COLUMN Hash VARBINARY(255);
+
+ALTER TABLE Patients ALTER COLUMN Hash VARBINARY(255);
@@ -0,0 +1 @@
+-- SQLite does not enforce column lengths; nothing to change
@@ -0,0 +1,15 @@
+-- appointment IDs are numbers from a block-reserved sequence.
+-- Databases created before migrations were versioned may have indexes on the old column
+DROP INDEX IF EXISTS IX_Availabilities_Open ON Availabilities;
+
+DROP INDEX IF EXISTS IX_Availabilities_apptID ON Availabilities;
+
+ALTER TABLE Availabilities ALTER COLUMN apptID bigint;
+
+ALTER TABLE Patients ALTER COLUMN apptID bigint;
+
+CREATE TABLE ApptIDSequence (
+    Name varchar(64),
+    NextID bigint,
+    PRIMARY KEY (Name)
+);
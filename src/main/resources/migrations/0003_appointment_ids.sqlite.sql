@@ -0,0 +1,38 @@
+-- appointment IDs are numbers from a block-reserved sequence.
+-- SQLite cannot change a column's type, so both tables are rebuilt
+CREATE TABLE Availabilities_new (
+    Time date,
+    Username varchar(255),
+    apptID bigint,
+    Name varchar(255),
+    PRIMARY KEY (Time, Username),
+    FOREIGN KEY (Name) REFERENCES Vaccines,
+    FOREIGN KEY (Username) REFERENCES Caregivers
+);
+
+INSERT INTO Availabilities_new (Time, Username, apptID, Name)
+SELECT Time, Username, CAST(apptID AS INTEGER), Name FROM Availabilities;
+
+DROP TABLE Availabilities;
+
+ALTER TABLE Availabilities_new RENAME TO Availabilities;
+
+CREATE TABLE Patients_new (
+	Username varchar(255) PRIMARY KEY,
+	Salt BINARY(16),
+	Hash VARBINARY(255),
+	apptID bigint
+);
+
+INSERT INTO Patients_new (Username, Salt, Hash, apptID)
+SELECT Username, Salt, Hash, CAST(apptID AS INTEGER) FROM Patients;
+
+DROP TABLE Patients;
+
+ALTER TABLE Patients_new RENAME TO Patients;
+
+CREATE TABLE ApptIDSequence (
+    Name varchar(64),
+    NextID bigint,
+    PRIMARY KEY (Name)
+);
@@ -0,0 +1,10 @@
+CREATE TABLE Waitlist (
+    Username varchar(255),
+    Name varchar(255),
+    StartDate date,
+    EndDate date,
+    JoinedAt datetime,
+    PRIMARY KEY (Username),
+    FOREIGN KEY (Username) REFERENCES Patients,
+    FOREIGN KEY (Name) REFERENCES Vaccines
+);
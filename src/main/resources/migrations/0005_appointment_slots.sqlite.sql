@@ -0,0 +1,19 @@
+-- a caregiver publishes several times of day; the key gains Slot (minutes after midnight).
+-- Existing availability becomes one 09:00 slot, the time a day was shown as before
+CREATE TABLE Availabilities_new (
+    Time date,
+    Username varchar(255),
+    Slot int,
+    apptID bigint,
+    Name varchar(255),
+    PRIMARY KEY (Time, Username, Slot),
+    FOREIGN KEY (Name) REFERENCES Vaccines,
+    FOREIGN KEY (Username) REFERENCES Caregivers
+);
+
+INSERT INTO Availabilities_new (Time, Username, Slot, apptID, Name)
+SELECT Time, Username, 540, apptID, Name FROM Availabilities;
+
+DROP TABLE Availabilities;
+
+ALTER TABLE Availabilities_new RENAME TO Availabilities;
@@ -0,0 +1,13 @@
+-- open slots by date and time of day, for search_caregiver_schedule and reserve
+CREATE INDEX IX_Availabilities_Open ON Availabilities (Time, Slot, Username) WHERE apptID IS NULL;
+
+-- appointment IDs are unique; also the seek for cancel, appt_reserved and show_appointments
+CREATE UNIQUE INDEX UX_Availabilities_apptID ON Availabilities (apptID) WHERE apptID IS NOT NULL;
+
+CREATE UNIQUE INDEX UX_Patients_apptID ON Patients (apptID) WHERE apptID IS NOT NULL;
+
+-- waitlist in arrival order per vaccine, for the matcher
+CREATE INDEX IX_Waitlist_Name ON Waitlist (Name, JoinedAt);
+
+-- a caregiver's appointments in ID order, for paginated show_appointments
+CREATE INDEX IX_Availabilities_Username_apptID ON Availabilities (Username, apptID) WHERE apptID IS NOT NULL;
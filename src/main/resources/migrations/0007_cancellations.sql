@@ -0,0 +1,14 @@
+-- one row per cancelled appointment, kept for reporting (the slot itself is freed or deleted)
+CREATE TABLE Cancellations (
+    apptID bigint,
+    Time date,
+    Slot int,
+    Caregiver varchar(255),
+    Patient varchar(255),
+    Name varchar(255),
+    CancelledBy varchar(16),
+    CancelledAt datetime,
+    PRIMARY KEY (apptID)
+);
+
+CREATE INDEX IX_Cancellations_Time ON Cancellations (Time, Name);
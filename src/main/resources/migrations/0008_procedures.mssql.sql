@@ -0,0 +1,139 @@
+-- stored procedures for the hot commands, used when StoredProcedures=1 (see db/Procedures.py).
+-- Each returns one row whose Status is 0 on success. The caller's transaction wraps the call
+-- and is rolled back on any other status, so a procedure may stop part way through.
+
+CREATE OR ALTER PROCEDURE ReserveAppointment
+    @Patient varchar(255),
+    @Time date,
+    @Vaccine varchar(255),
+    @Slot int,
+    @ApptID bigint
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Doses int, @Booked bigint, @Caregiver varchar(255), @Claimed int;
+
+    SELECT @Doses = Doses FROM Vaccines WHERE Name = @Vaccine;
+    IF @@ROWCOUNT = 0
+    BEGIN
+        SELECT 1 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+    IF @Doses <= 0
+    BEGIN
+        SELECT 2 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    -- lock the patient row so the same patient cannot book twice concurrently
+    SELECT @Booked = apptID FROM Patients WITH (UPDLOCK, ROWLOCK) WHERE Username = @Patient;
+    IF @Booked IS NOT NULL
+    BEGIN
+        SELECT 3 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    IF @Slot IS NULL
+        SELECT TOP 1 @Caregiver = Username, @Claimed = Slot
+        FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+        WHERE Time = @Time AND apptID IS NULL
+        ORDER BY Slot, Username;
+    ELSE
+        SELECT TOP 1 @Caregiver = Username, @Claimed = Slot
+        FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+        WHERE Time = @Time AND Slot = @Slot AND apptID IS NULL
+        ORDER BY Username;
+    IF @Caregiver IS NULL
+    BEGIN
+        SELECT 4 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    UPDATE Availabilities SET Name = @Vaccine, apptID = @ApptID
+    WHERE Time = @Time AND Username = @Caregiver AND Slot = @Claimed AND apptID IS NULL;
+    IF @@ROWCOUNT <> 1
+    BEGIN
+        SELECT 5 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    UPDATE Patients SET apptID = @ApptID WHERE Username = @Patient AND apptID IS NULL;
+    IF @@ROWCOUNT <> 1
+    BEGIN
+        SELECT 3 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    -- the hot Vaccines row is touched last so its lock is held for the shortest time
+    UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = @Vaccine AND Doses > 0;
+    IF @@ROWCOUNT <> 1
+    BEGIN
+        SELECT 2 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    SELECT 0 AS Status, @ApptID AS apptID, @Caregiver AS Caregiver, @Claimed AS Slot;
+END
+GO
+
+CREATE OR ALTER PROCEDURE CancelAppointment
+    @ApptID bigint,
+    @User varchar(255),
+    @CancelledBy varchar(16),
+    @CancelledAt datetime
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Vaccine varchar(255), @Time date, @Slot int, @Caregiver varchar(255), @Patient varchar(255);
+
+    SELECT @Vaccine = a.Name, @Time = a.Time, @Slot = a.Slot, @Caregiver = a.Username, @Patient = p.Username
+    FROM Availabilities a WITH (UPDLOCK, ROWLOCK) JOIN Patients p ON a.apptID = p.apptID
+    WHERE a.apptID = @ApptID;
+    -- patients cancel their own appointment, caregivers one on their own schedule
+    IF @@ROWCOUNT = 0 OR (@CancelledBy = 'patient' AND @Patient <> @User)
+            OR (@CancelledBy = 'caregiver' AND @Caregiver <> @User)
+    BEGIN
+        SELECT 6 AS Status, NULL AS Name;
+        RETURN;
+    END
+
+    IF @CancelledBy = 'patient'
+        -- for patients: make the appointment available again
+        UPDATE Availabilities SET apptID = NULL, Name = NULL WHERE apptID = @ApptID;
+    ELSE
+        -- for caregivers: remove the time slot from availability
+        DELETE FROM Availabilities WHERE apptID = @ApptID;
+    UPDATE Patients SET apptID = NULL WHERE Username = @Patient;
+
+    INSERT INTO Cancellations (apptID, Time, Slot, Caregiver, Patient, Name, CancelledBy, CancelledAt)
+    VALUES (@ApptID, @Time, @Slot, @Caregiver, @Patient, @Vaccine, @CancelledBy, @CancelledAt);
+
+    UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = @Vaccine;
+
+    SELECT 0 AS Status, @Vaccine AS Name;
+END
+GO
+
+-- @Slots is a comma-separated list of start times (minutes after midnight)
+CREATE OR ALTER PROCEDURE UploadAvailability
+    @Caregiver varchar(255),
+    @Time date,
+    @Slots varchar(max)
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Inserted int;
+
+    INSERT INTO Availabilities (Time, Username, Slot)
+    SELECT DISTINCT @Time, @Caregiver, CAST(s.value AS int)
+    FROM STRING_SPLIT(@Slots, ',') s
+    WHERE NOT EXISTS (SELECT 1 FROM Availabilities a
+                      WHERE a.Time = @Time AND a.Username = @Caregiver AND a.Slot = CAST(s.value AS int));
+    SET @Inserted = @@ROWCOUNT;
+
+    SELECT 0 AS Status, @Inserted AS Inserted;
+END
+GO
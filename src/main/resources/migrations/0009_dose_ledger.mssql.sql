@@ -0,0 +1,160 @@
+-- vaccine stock moves to partitioned counters with an append-only ledger (see db/DoseLedger.py).
+-- Vaccines.Doses becomes the balance as of the last compaction. Existing stock starts in
+-- stripe 0 and is spread over the other stripes by the first compaction
+CREATE TABLE DoseCounters (
+    Name varchar(255),
+    Stripe int,
+    Doses int,
+    PRIMARY KEY (Name, Stripe),
+    FOREIGN KEY (Name) REFERENCES Vaccines
+);
+GO
+
+CREATE TABLE DoseLedger (
+    EntryID bigint IDENTITY(1, 1),
+    Name varchar(255),
+    Delta int,
+    Reason varchar(16),
+    apptID bigint,
+    CreatedAt datetime,
+    PRIMARY KEY (EntryID)
+);
+GO
+
+CREATE TABLE DoseHolds (
+    apptID bigint,
+    Name varchar(255),
+    Stripe int,
+    ExpiresAt datetime,
+    PRIMARY KEY (apptID)
+);
+GO
+
+CREATE INDEX IX_DoseHolds_ExpiresAt ON DoseHolds (ExpiresAt);
+GO
+
+INSERT INTO DoseCounters (Name, Stripe, Doses) SELECT Name, 0, Doses FROM Vaccines;
+GO
+
+-- the procedures from 0008, taking and returning doses through the counters and the ledger
+CREATE OR ALTER PROCEDURE ReserveAppointment
+    @Patient varchar(255),
+    @Time date,
+    @Vaccine varchar(255),
+    @Slot int,
+    @ApptID bigint
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Stripe int, @Taken int = 0, @Booked bigint, @Caregiver varchar(255), @Claimed int;
+
+    IF NOT EXISTS (SELECT 1 FROM Vaccines WHERE Name = @Vaccine)
+    BEGIN
+        SELECT 1 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    -- one dose from a random stripe with stock, so concurrent bookings update different rows;
+    -- a stripe emptied in the meantime is skipped
+    WHILE @Taken = 0
+    BEGIN
+        SET @Stripe = NULL;
+        SELECT TOP 1 @Stripe = Stripe FROM DoseCounters WHERE Name = @Vaccine AND Doses > 0 ORDER BY NEWID();
+        IF @Stripe IS NULL
+        BEGIN
+            SELECT 2 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+            RETURN;
+        END
+        UPDATE DoseCounters SET Doses = Doses - 1 WHERE Name = @Vaccine AND Stripe = @Stripe AND Doses > 0;
+        SET @Taken = @@ROWCOUNT;
+    END
+    INSERT INTO DoseLedger (Name, Delta, Reason, apptID, CreatedAt)
+    VALUES (@Vaccine, -1, 'reserve', @ApptID, GETDATE());
+
+    -- lock the patient row so the same patient cannot book twice concurrently
+    SELECT @Booked = apptID FROM Patients WITH (UPDLOCK, ROWLOCK) WHERE Username = @Patient;
+    IF @Booked IS NOT NULL
+    BEGIN
+        SELECT 3 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    IF @Slot IS NULL
+        SELECT TOP 1 @Caregiver = Username, @Claimed = Slot
+        FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+        WHERE Time = @Time AND apptID IS NULL
+        ORDER BY Slot, Username;
+    ELSE
+        SELECT TOP 1 @Caregiver = Username, @Claimed = Slot
+        FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+        WHERE Time = @Time AND Slot = @Slot AND apptID IS NULL
+        ORDER BY Username;
+    IF @Caregiver IS NULL
+    BEGIN
+        SELECT 4 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    UPDATE Availabilities SET Name = @Vaccine, apptID = @ApptID
+    WHERE Time = @Time AND Username = @Caregiver AND Slot = @Claimed AND apptID IS NULL;
+    IF @@ROWCOUNT <> 1
+    BEGIN
+        SELECT 5 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    UPDATE Patients SET apptID = @ApptID WHERE Username = @Patient AND apptID IS NULL;
+    IF @@ROWCOUNT <> 1
+    BEGIN
+        SELECT 3 AS Status, NULL AS apptID, NULL AS Caregiver, NULL AS Slot;
+        RETURN;
+    END
+
+    SELECT 0 AS Status, @ApptID AS apptID, @Caregiver AS Caregiver, @Claimed AS Slot;
+END
+GO
+
+CREATE OR ALTER PROCEDURE CancelAppointment
+    @ApptID bigint,
+    @User varchar(255),
+    @CancelledBy varchar(16),
+    @CancelledAt datetime
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+    DECLARE @Vaccine varchar(255), @Time date, @Slot int, @Caregiver varchar(255), @Patient varchar(255),
+        @Stripe int;
+
+    SELECT @Vaccine = a.Name, @Time = a.Time, @Slot = a.Slot, @Caregiver = a.Username, @Patient = p.Username
+    FROM Availabilities a WITH (UPDLOCK, ROWLOCK) JOIN Patients p ON a.apptID = p.apptID
+    WHERE a.apptID = @ApptID;
+    -- patients cancel their own appointment, caregivers one on their own schedule
+    IF @@ROWCOUNT = 0 OR (@CancelledBy = 'patient' AND @Patient <> @User)
+            OR (@CancelledBy = 'caregiver' AND @Caregiver <> @User)
+    BEGIN
+        SELECT 6 AS Status, NULL AS Name;
+        RETURN;
+    END
+
+    IF @CancelledBy = 'patient'
+        -- for patients: make the appointment available again
+        UPDATE Availabilities SET apptID = NULL, Name = NULL WHERE apptID = @ApptID;
+    ELSE
+        -- for caregivers: remove the time slot from availability
+        DELETE FROM Availabilities WHERE apptID = @ApptID;
+    UPDATE Patients SET apptID = NULL WHERE Username = @Patient;
+
+    INSERT INTO Cancellations (apptID, Time, Slot, Caregiver, Patient, Name, CancelledBy, CancelledAt)
+    VALUES (@ApptID, @Time, @Slot, @Caregiver, @Patient, @Vaccine, @CancelledBy, @CancelledAt);
+
+    -- the dose goes back to a random stripe
+    SELECT TOP 1 @Stripe = Stripe FROM DoseCounters WHERE Name = @Vaccine ORDER BY NEWID();
+    UPDATE DoseCounters SET Doses = Doses + 1 WHERE Name = @Vaccine AND Stripe = @Stripe;
+    INSERT INTO DoseLedger (Name, Delta, Reason, apptID, CreatedAt)
+    VALUES (@Vaccine, 1, 'cancel', @ApptID, @CancelledAt);
+
+    SELECT 0 AS Status, @Vaccine AS Name;
+END
+GO
@@ -0,0 +1,31 @@
+-- vaccine stock moves to partitioned counters with an append-only ledger (see db/DoseLedger.py).
+-- Vaccines.Doses becomes the balance as of the last compaction. Existing stock starts in
+-- stripe 0 and is spread over the other stripes by the first compaction
+CREATE TABLE DoseCounters (
+    Name varchar(255),
+    Stripe int,
+    Doses int,
+    PRIMARY KEY (Name, Stripe),
+    FOREIGN KEY (Name) REFERENCES Vaccines
+);
+
+CREATE TABLE DoseLedger (
+    EntryID INTEGER PRIMARY KEY,
+    Name varchar(255),
+    Delta int,
+    Reason varchar(16),
+    apptID bigint,
+    CreatedAt datetime
+);
+
+CREATE TABLE DoseHolds (
+    apptID bigint,
+    Name varchar(255),
+    Stripe int,
+    ExpiresAt datetime,
+    PRIMARY KEY (apptID)
+);
+
+CREATE INDEX IX_DoseHolds_ExpiresAt ON DoseHolds (ExpiresAt);
+
+INSERT INTO DoseCounters (Name, Stripe, Doses) SELECT Name, 0, Doses FROM Vaccines;
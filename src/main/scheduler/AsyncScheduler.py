@@ -0,0 +1,178 @@
+"""
+Async versions of the command handlers, for serving many sessions from one event loop.
+
+Database work goes through async_db, so a handler waiting on the database does not hold
+a thread, and independent queries are issued together with asyncio.gather. Parsing,
+validation and output are shared with the blocking handlers in Scheduler. Commands
+without an async version here run their blocking handler on async_db's threads.
+"""
+import asyncio
+from Scheduler import (COMMANDS, GET_OPEN_TIMES, appointments_query, book, caregiver_schedule_query,
+                       get_vaccine_inventory, parse_reserve, print_already_booked, print_appointments,
+                       print_caregiver_schedule, username_exists_caregiver, username_exists_patient,
+                       vaccine_in_stock)
+from Session import current_session
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from model.VaccineCache import vaccine_cache
+from util.Util import Util
+from db.AsyncDatabase import async_db
+from db.StorageBackend import DatabaseError, get_backend
+from db.Instrumentation import instrumentation
+
+
+async def create_user(tokens, model, username_exists):
+    if len(tokens) != 3:
+        print("Failed to create user.")
+        return
+    username = tokens[1].lower()
+    password = tokens[2].lower()
+
+    # the username check and the (deliberately slow) password hash do not depend on each other
+    salt = Util.generate_salt()
+    exists, hash = await asyncio.gather(async_db.run(username_exists, username),
+                                        async_db.run(Util.generate_hash, password, salt))
+    if exists:
+        print("Username taken, try again!")
+        return
+
+    try:
+        await model(username, salt=salt, hash=hash).save_to_db_async()
+    except DatabaseError as e:
+        print("Failed to create user.")
+        print("Db-Error:", e)
+        return
+    except Exception as e:
+        print("Failed to create user.")
+        print(e)
+        return
+    print("Created user ", username)
+
+
+async def create_patient(tokens):
+    await create_user(tokens, Patient, username_exists_patient)
+
+
+async def create_caregiver(tokens):
+    await create_user(tokens, Caregiver, username_exists_caregiver)
+
+
+async def login(tokens, model, attribute):
+    session = current_session()
+    if session.caregiver is not None or session.patient is not None:
+        print("User already logged in.")
+        return
+    if len(tokens) != 3:
+        print("Login failed.")
+        return
+
+    username = tokens[1].lower()
+    try:
+        user = await model(username, password=tokens[2].lower()).get_async()
+    except Exception as e:
+        print("Login failed.")
+        print("Error:", e)
+        return
+    if user is None:
+        print("Login failed.")
+    else:
+        print("Logged in as: " + username)
+        setattr(session, attribute, user)
+
+
+async def login_patient(tokens):
+    await login(tokens, Patient, "patient")
+
+
+async def login_caregiver(tokens):
+    await login(tokens, Caregiver, "caregiver")
+
+
+async def search_caregiver_schedule(tokens):
+    session = current_session()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+    if len(tokens) != 2:
+        # the date range and paginated forms are a single streamed query; nothing to overlap
+        await async_db.run(COMMANDS["search_caregiver_schedule"], tokens)
+        return
+    try:
+        d = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please enter the date in the form MM-DD-YYYY")
+        return
+
+    inventory, times, rows = await asyncio.gather(async_db.run(get_vaccine_inventory),
+                                                  async_db.fetchall(GET_OPEN_TIMES, d),
+                                                  async_db.fetchall(*caregiver_schedule_query(get_backend(), d)))
+    if not inventory:
+        print("There are no vaccines available at this time. Try again later.")
+        return
+    print_caregiver_schedule(d, rows, [row['Slot'] for row in times], inventory)
+
+
+async def reserve(tokens):
+    request = parse_reserve(tokens)
+    if request is None:
+        return
+    d, vaccine_name, slot = request
+
+    # the stock check and the patient's existing appointment are independent reads
+    doses, booked = await asyncio.gather(
+        async_db.run(vaccine_cache.get_doses, vaccine_name),
+        async_db.fetchall("SELECT apptID FROM Patients WHERE Username = %s AND apptID IS NOT NULL;",
+                          current_session().patient.get_username()))
+    if not vaccine_in_stock(vaccine_name, doses):
+        return
+    if booked:
+        print_already_booked()
+        return
+    await async_db.run(book, d, vaccine_name, slot)
+
+
+async def show_appointments(tokens):
+    session = current_session()
+    if session.caregiver is None and session.patient is None:
+        print("Please login first!")
+        return
+    if len(tokens) != 1:
+        # the paginated form streams from one cursor on a database thread
+        await async_db.run(COMMANDS["show_appointments"], tokens)
+        return
+    try:
+        rows = await async_db.fetchall(*appointments_query(session))
+    except Exception as e:
+        print(e)
+        print("Please try again!")
+        return
+    print_appointments(rows)
+
+
+ASYNC_COMMANDS = {
+    "create_patient": create_patient,
+    "create_caregiver": create_caregiver,
+    "login_patient": login_patient,
+    "login_caregiver": login_caregiver,
+    "search_caregiver_schedule": search_caregiver_schedule,
+    "reserve": reserve,
+    "show_appointments": show_appointments,
+}
+
+
+async def dispatch_async(tokens):
+    # async counterpart of Scheduler.dispatch; returns False once the user quits
+    operation = tokens[0]
+    if operation == "quit":
+        print("Bye!")
+        return False
+    handler = ASYNC_COMMANDS.get(operation)
+    if handler is None and operation not in COMMANDS:
+        print("Invalid operation name!")
+        return True
+    with instrumentation.command(operation):
+        if handler is not None:
+            await handler(tokens)
+        else:
+            await async_db.run(COMMANDS[operation], tokens)
+    return True
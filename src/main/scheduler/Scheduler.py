@@ -1,21 +1,24 @@
 from model.Vaccine import Vaccine
-from model.Caregiver import Caregiver
+from model.Caregiver import Caregiver, SLOT_MINUTES
 from model.Patient import Patient
+from model.CredentialCache import credential_cache
+from model.VaccineCache import vaccine_cache
+from model.UserImporter import UserImporter
+from Session import current_session
 from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.ConnectionManager import ConnectionManager, SharedConnection
+from db.StorageBackend import DatabaseError
+from db.Instrumentation import instrumentation
+from db.ReservationEngine import ReservationEngine, InvalidVaccine, OutOfStock, AlreadyBooked, NoSlotAvailable
+from db.WaitlistMatcher import WaitlistMatcher
+from db.Procedures import procedures, OK
+from db.DoseLedger import dose_ledger
+import argparse
+import csv
 import datetime
 import re
-
-
-'''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
-'''
-current_patient = None
-
-current_caregiver = None
+import sys
+import time
 
 
 def create_patient(tokens):
@@ -25,8 +28,8 @@ def create_patient(tokens):
         print("Failed to create user.")
         return
 
-    username = tokens[1]
-    password = tokens[2]
+    username = tokens[1].lower()
+    password = tokens[2].lower()
     # check 2: check if the username has been taken already
     if username_exists_patient(username):
         print("Username taken, try again!")
@@ -41,7 +44,7 @@ def create_patient(tokens):
     # save to caregiver information to our database
     try:
         patient.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -51,26 +54,58 @@ def create_patient(tokens):
         return
     print("Created user ", username)
 
-def username_exists_patient(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
+def import_patients(tokens):
+    # import_patients <file> [--workers N]
+    import_users(tokens, "Patients")
 
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
+
+def import_caregivers(tokens):
+    # import_caregivers <file> [--workers N]
+    import_users(tokens, "Caregivers")
+
+
+def import_users(tokens, table):
+    # bulk account creation for onboarding; the file is CSV (username,password) or JSONL
+    session = current_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        positional, options = parse_page_options(tokens[1:], "--workers")
+        workers = int(options["--workers"]) if "--workers" in options else None
+        if len(positional) != 1 or (workers is not None and workers <= 0):
+            raise ValueError(tokens)
+    except ValueError:
+        print(f"Please try again!\nMust enter '{tokens[0]} <file> [--workers N]'")
+        return
+
+    importer = UserImporter(table, workers=workers)
+    try:
+        created, skipped, failed = importer.run(positional[0])
+    except OSError as e:
+        print("Could not read the import file.")
+        print("Error:", e)
+        return
+    except DatabaseError as e:
+        print("Import failed")
+        print("Db-Error:", e)
+        quit()
+    for line, message in importer.errors:
+        print(f"line {line}: {message}")
+    print(f"Imported {table.lower()}: {created} created, {skipped} skipped (already exist), {failed} failed.")
+
+
+def username_exists_patient(username):
+    # answered from the credential cache, which also remembers recently unknown names
+    try:
+        return credential_cache.exists("Patients", username)
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
-    finally:
-        cm.close_connection()
     return False
 
 def create_caregiver(tokens):
@@ -80,8 +115,8 @@ def create_caregiver(tokens):
         print("Failed to create user.")
         return
 
-    username = tokens[1]
-    password = tokens[2]
+    username = tokens[1].lower()
+    password = tokens[2].lower()
     # check 2: check if the username has been taken already
     if username_exists_caregiver(username):
         print("Username taken, try again!")
@@ -96,7 +131,7 @@ def create_caregiver(tokens):
     # save to caregiver information to our database
     try:
         caregiver.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -108,33 +143,24 @@ def create_caregiver(tokens):
 
 
 def username_exists_caregiver(username):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
+    # answered from the credential cache, which also remembers recently unknown names
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
-        #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
-        for row in cursor:
-            return row['Username'] is not None
-    except pymssql.Error as e:
+        return credential_cache.exists("Caregivers", username)
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
     except Exception as e:
         print("Error occurred when checking username")
         print("Error:", e)
-    finally:
-        cm.close_connection()
     return False
 
 
 def login_patient(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    if current_caregiver is not None or current_patient is not None:
+    session = current_session()
+    if session.caregiver is not None or session.patient is not None:
         print("User already logged in.")
         return
 
@@ -143,14 +169,14 @@ def login_patient(tokens):
         print("Login failed.")
         return
 
-    username = tokens[1]
-    password = tokens[2]
+    username = tokens[1].lower()
+    password = tokens[2].lower()
 
     patient = None
     try:
         patient = Patient(username, password=password).get()
-        current_patient = patient
-    except pymssql.Error as e:
+        session.patient = patient
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -164,13 +190,13 @@ def login_patient(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_patient = patient
+        session.patient = patient
 
 def login_caregiver(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    session = current_session()
+    if session.caregiver is not None or session.patient is not None:
         print("User already logged in.")
         return
 
@@ -179,13 +205,13 @@ def login_caregiver(tokens):
         print("Login failed.")
         return
 
-    username = tokens[1]
-    password = tokens[2]
+    username = tokens[1].lower()
+    password = tokens[2].lower()
 
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -199,20 +225,50 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.caregiver = caregiver
+
+
+def parse_page_options(tokens, *names):
+    # split "--name value" options (only those in names) from the positional tokens;
+    # returns (positional, {name: value}) and raises ValueError on an unknown or incomplete option
+    positional = []
+    options = {}
+    i = 0
+    while i < len(tokens):
+        if tokens[i].startswith("--"):
+            name = tokens[i].lower()
+            if name not in names or i + 1 >= len(tokens):
+                raise ValueError(tokens[i])
+            options[name] = tokens[i + 1]
+            i += 2
+        else:
+            positional.append(tokens[i])
+            i += 1
+    if "--limit" in options:
+        options["--limit"] = int(options["--limit"])
+        if options["--limit"] <= 0:
+            raise ValueError("--limit")
+    return positional, options
 
 
 def search_caregiver_schedule(tokens):
-
-    global current_caregiver
-    global current_patient
-    if current_caregiver is None and current_patient is None:
+    # search_caregiver_schedule <date> [--limit N] [--after <caregiver>]
+    # search_caregiver_schedule <start date> <end date> [--limit N] [--after <date>]
+    session = current_session()
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
+    try:
+        tokens, options = parse_page_options(tokens, "--limit", "--after")
+    except ValueError:
+        print("Invalid option. Use --limit <number> and --after <last value shown>.")
+        return
+
+    # search_caregiver_schedule <start date> <end date>
+    if len(tokens) == 3:
+        search_caregiver_schedule_range(tokens, options.get("--limit"), options.get("--after"))
+        return
 
     # Check for arguments
     if len(tokens) !=2:
@@ -228,7 +284,7 @@ def search_caregiver_schedule(tokens):
         month = int(date_tokens[0])
         day = int(date_tokens[1])
         year = int(date_tokens[2])
-        d = datetime.datetime(year, month, day)
+        d = datetime.date(year, month, day)
     except:
         print("Please enter the date in the form MM-DD-YYYY")
         return
@@ -239,149 +295,263 @@ def search_caregiver_schedule(tokens):
         print("There are no vaccines available at this time. Try again later.")
         return
 
+    limit = options.get("--limit")
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor(as_dict=True)
     try:
-        get_caregiver_schedule = "SELECT Username, Time FROM Availabilities WHERE Time = %s AND apptID IS NULL " \
-                                 "ORDER BY Username;"
-        cursor.execute(get_caregiver_schedule, d)
-        if cursor.rowcount == 0:
-            print(f"There are no appointments available on {month}-{day}-{year}\n"
-                  f"Try another date.")
-            return
-        print("PROVIDERS:")
-        for row in cursor:
-            print(row['Username'])
-        print("\nVACCINE AVAILABILITY:")
-        for key in inventory:
-            print(f"{key} {inventory[key]}")
-    except pymssql.Error as e:
+        cursor.execute(GET_OPEN_TIMES, d)
+        times = [row['Slot'] for row in cursor.fetchall()]
+        after = options.get("--after")
+        cursor.execute(*caregiver_schedule_query(cm.backend, d, limit, after.lower() if after else None))
+        print_caregiver_schedule(d, cursor.stream(), times, inventory, limit)
+    except DatabaseError as e:
          raise e
     finally:
         cm.close_connection()
     return None
 
-def get_vaccine_inventory(name=None):
+
+# the distinct open times on a day: at most one per slot of the day, so always small
+GET_OPEN_TIMES = "SELECT DISTINCT Slot FROM Availabilities WHERE Time = %s AND apptID IS NULL ORDER BY Slot;"
+
+
+def caregiver_schedule_query(backend, d, limit=None, after=None):
+    # (query, params) for the caregivers with open slots on d, in username order; keyset-paginated
+    # by username, and one row past limit is asked for to tell whether there is another page
+    query = "SELECT Username, COUNT(*) AS Slots, MIN(Slot) AS FirstSlot FROM Availabilities " \
+            "WHERE Time = %s AND apptID IS NULL"
+    params = (d,)
+    if after is not None:
+        query += " AND Username > %s"
+        params += (after,)
+    query += " GROUP BY Username ORDER BY Username"
+    if limit is not None:
+        query = backend.first_rows(query, limit + 1)
+    return query, params
+
+
+def print_caregiver_schedule(d, rows, times, inventory, limit=None):
+    # rows: the caregivers with open slots on day d (see caregiver_schedule_query), read as they stream in
+    shown = 0
+    last = None
+    for row in rows:
+        if shown == 0:
+            print("PROVIDERS:")
+        if limit is not None and shown == limit:
+            print(f"... more: search_caregiver_schedule {d.month}-{d.day}-{d.year} --limit {limit} --after {last}")
+            break
+        print(f"{row['Username']} {row['Slots']} open from {Util.format_time(row['FirstSlot'])}")
+        last = row['Username']
+        shown += 1
+    if shown == 0:
+        print(f"There are no appointments available on {d.month}-{d.day}-{d.year}\n"
+              f"Try another date.")
+        return
+    print("\nOPEN TIMES:")
+    print(" ".join(Util.format_time(slot) for slot in times))
+    print("\nVACCINE AVAILABILITY:")
+    for key in inventory:
+        print(f"{key} {inventory[key]}")
+
+
+def search_caregiver_schedule_range(tokens, limit=None, after=None):
+    # open slots per day and per caregiver between two dates (inclusive), from one grouped query;
+    # with limit, at most limit days are shown, continuing after the date given as after
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+        after = Util.parse_date(after) if after is not None else None
+    except ValueError:
+        print("Please enter the dates in the form MM-DD-YYYY")
+        return
+    if end < start:
+        print("The end date must not be before the start date.")
+        return
+
+    inventory = get_vaccine_inventory()
+    if not inventory:
+        print("There are no vaccines available at this time. Try again later.")
+        return
+
+    if after is not None and after >= start:
+        start = after + datetime.timedelta(days=1)
+    days_filter = "Time >= %s AND Time <= %s AND apptID IS NULL"
+    params = (start, end)
+
+    by_day = {}
+    by_caregiver = {}
+    more = False
     cm = ConnectionManager()
     conn = cm.create_connection()
     cursor = conn.cursor(as_dict=True)
-    if name:
-        query = "SELECT Name, Doses FROM Vaccines WHERE Name=%s"
-        cursor.execute(query, name)
-    else:
-        query = "SELECT Name, Doses FROM Vaccines ORDER BY Doses;"
-        cursor.execute(query)
+    try:
+        count_open_slots = f"SELECT Time, Username, COUNT(*) AS Slots FROM Availabilities WHERE {days_filter}"
+        if limit is not None:
+            # the first limit + 1 days with an open slot, so the page boundary is pushed into SQL
+            first_days = cm.backend.first_rows(f"SELECT Time FROM Availabilities WHERE {days_filter} "
+                                               f"GROUP BY Time ORDER BY Time", limit + 1)
+            count_open_slots += f" AND Time IN ({first_days})"
+            params += params
+        count_open_slots += " GROUP BY Time, Username ORDER BY Time, Username;"
+        cursor.execute(count_open_slots, params)
+        for row in cursor.stream():
+            if limit is not None and row['Time'] not in by_day and len(by_day) == limit:
+                more = True
+                break
+            by_day.setdefault(row['Time'], []).append((row['Username'], row['Slots']))
+            by_caregiver[row['Username']] = by_caregiver.get(row['Username'], 0) + row['Slots']
+    finally:
+        cm.close_connection()
+
+    if not by_day:
+        print(f"There are no appointments available between {start.month}-{start.day}-{start.year} and "
+              f"{end.month}-{end.day}-{end.year}\nTry other dates.")
+        return
 
-    inventory = {}
-    for row in cursor:
-        inventory[row['Name']] = row['Doses']
-    cm.close_connection()
-    return inventory
+    print("OPEN SLOTS BY DAY:")
+    for d, caregivers in by_day.items():
+        total = sum(slots for _, slots in caregivers)
+        providers = ", ".join(f"{username} {slots}" for username, slots in caregivers)
+        print(f"{d.month}-{d.day}-{d.year} {total} ({providers})")
+    if more:
+        last = max(by_day)
+        print(f"... more: search_caregiver_schedule {tokens[1]} {tokens[2]} --limit {limit} "
+              f"--after {last.month}-{last.day}-{last.year}")
+    print("\nOPEN SLOTS BY PROVIDER:")
+    for username in sorted(by_caregiver):
+        print(f"{username} {by_caregiver[username]}")
+    print("\nVACCINE AVAILABILITY:")
+    for key in inventory:
+        print(f"{key} {inventory[key]}")
+
+
+def get_vaccine_inventory(name=None):
+    # served from the in-process vaccine cache; no database round trip while it is fresh
+    inventory = vaccine_cache.inventory()
+    if name:
+        return {name: inventory[name]} if name in inventory else {}
+    return dict(sorted(inventory.items(), key=lambda item: item[1]))
 
 
 def reserve(tokens):
-    """
-    """
-    # login_caregiver <username> <password>
-    # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    global current_caregiver
-    if current_caregiver:
-        print("You must be a patient to reserve an appointment.")
-        return
-    if not current_patient:
-        print("Please login to reserve an appointment")
+    request = parse_reserve(tokens)
+    if request is None:
         return
+    d, vaccine_name, slot = request
 
-    # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
-        print("Invalid input.\nMust enter 'reserve <date> <vaccine name>'")
+    # cheap checks against the cached inventory first; the booking transaction re-checks stock
+    if not vaccine_in_stock(vaccine_name, vaccine_cache.get_doses(vaccine_name)):
         return
+    book(d, vaccine_name, slot)
 
-    date = tokens[1]
-    vaccine_name = tokens[2]
 
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
-    d = datetime.datetime(year, month, day)
+def parse_reserve(tokens):
+    # reserve <date> <vaccine> [<time>]; returns (date, vaccine name, slot or None), or None after saying why not
+    # check 1: only a logged-in patient can reserve
+    session = current_session()
+    if session.caregiver:
+        print("You must be a patient to reserve an appointment.")
+        return None
+    if not session.patient:
+        print("Please login to reserve an appointment")
+        return None
 
-    # Get vaccine inventory and check that there are doses available
-    if not is_vaccine_name_valid(vaccine_name):
+    # check 2: the length for tokens need to be 3 (or 4 with a time) to include all information
+    if len(tokens) not in (3, 4):
+        print("Invalid input.\nMust enter 'reserve <date> <vaccine name> [<time>]'")
+        return None
+
+    try:
+        d = Util.parse_date(tokens[1])
+    except ValueError:
+        print("Please enter the date in the form MM-DD-YYYY")
+        return None
+    slot = None
+    if len(tokens) == 4:
+        try:
+            slot = Util.parse_time(tokens[3])
+        except ValueError:
+            print("Please enter the time in the form HH:MM")
+            return None
+    return d, tokens[2].lower(), slot
+
+
+def vaccine_in_stock(vaccine_name, doses):
+    if doses is None:
         print("Invalid vaccine name, try again.")
-        return
-    inventory = get_vaccine_inventory(name=vaccine_name)
-    if inventory[vaccine_name] == 0:
+        return False
+    if doses == 0:
         print(f"There are no {vaccine_name} vaccines available at this time. Try again later or select a different "
               f"vaccine.")
-        return
+        return False
+    return True
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
 
+def book(d, vaccine_name, slot=None):
+    # book for the current patient through the reservation engine and report the outcome
+    session = current_session()
     try:
-        check_appt = "SELECT COUNT(apptID) as total FROM Patients WHERE Username=%s;"
-        cursor.execute(check_appt, current_patient.get_username())
-        for row in cursor:
-            if row['total'] > 0:
-                print("You already have an appointment.\n"
-                      "To show exisiting appointments: show_appointments\n"
-                      "To cancel an appointment: cancel <appointmentID>")
-                return
-
-        get_caregiver_schedule = "SELECT TOP 1 Username, apptID FROM Availabilities " \
-                                 "WHERE Time = %s AND apptID IS NULL ORDER BY Username;"
-        cursor.execute(get_caregiver_schedule, d)
-        if cursor.rowcount == 0:
-            print(f"There are no appointments available on {month}-{day}-{year}\n"
-                  f"Try another date.")
-            return
-        for row in cursor:
-            caregiver = row['Username']
-        apptID = Util.generate_apptID()
-        upload_reservation(caregiver, d, apptID, vaccine_name)
-        increment_doses(vaccine_name)
-        print(f"Appointment ID: {apptID}, Caregiver username: {caregiver}")
+        apptID, caregiver, booked = ReservationEngine().reserve(session.patient.get_username(), d, vaccine_name, slot)
+    except InvalidVaccine:
+        print("Invalid vaccine name, try again.")
+        return
+    except OutOfStock:
+        vaccine_cache.set_doses(vaccine_name, 0)
+        print(f"There are no {vaccine_name} vaccines available at this time. Try again later or select a different "
+              f"vaccine.")
+        return
+    except AlreadyBooked:
+        print_already_booked()
+        return
+    except NoSlotAvailable:
+        at = f" at {Util.format_time(slot)}" if slot is not None else ""
+        print(f"There are no appointments available on {d.month}-{d.day}-{d.year}{at}\n"
+              f"Try another date.")
+        return
     except Exception as e:
         print(e)
         print("An error occurred. No reservation was made.")
         return
-    finally:
-        cm.close_connection()
+    vaccine_cache.adjust(vaccine_name, -1)
+    print(f"Appointment ID: {apptID}, Caregiver username: {caregiver}, Time: {Util.format_time(booked)}")
 
 
-def upload_reservation(caregiver, d, apptID, vaccine_name):
-    global current_patient
+def print_already_booked():
+    print("You already have an appointment.\n"
+          "To show exisiting appointments: show_appointments\n"
+          "To cancel an appointment: cancel <appointmentID>")
+
+
+def parse_hours(start, end):
+    # the slot start times (minutes after midnight) from start up to, not including, end, every SLOT_MINUTES
+    first = Util.parse_time(start)
+    last = Util.parse_time(end)
+    if last <= first:
+        raise ValueError(f"Invalid time window: {start}-{end}")
+    return list(range(first, last, SLOT_MINUTES))
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
-    patient_name = current_patient.get_username()
-    add_apptID = "UPDATE Patients SET apptID=%s WHERE Username = %s;"
-    update_availability = "UPDATE Availabilities SET Name=%s, apptID=%s WHERE " \
-                          "Time=%s AND Username=%s;"
-    try:
-        cursor.execute(add_apptID, (apptID, patient_name))
-        cursor.execute(update_availability, (vaccine_name, apptID, d, caregiver))
-        conn.commit()
-    except pymssql.Error:
-        raise
-    finally:
-        cm.close_connection()
 
 def upload_availability(tokens):
-    #  upload_availability <date>
+    #  upload_availability <date> [<start time> <end time>]
+    #  with a time window, the day is published as one slot every SLOT_MINUTES
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    # check 2: the length for tokens need to be 2 (or 4 with a time window) to include all information
+    if len(tokens) not in (2, 4):
         print("Please try again!")
         return
+    slots = None
+    if len(tokens) == 4:
+        try:
+            slots = parse_hours(tokens[2], tokens[3])
+        except ValueError:
+            print("Please enter a valid time window, e.g. 09:00 17:00")
+            return
 
     date = tokens[1]
     # assume input is hyphenated in the format mm-dd-yyyy
@@ -394,9 +564,9 @@ def upload_availability(tokens):
         print("Invalid date format. Please try again!")
         return
     try:
-        d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+        d = datetime.date(year, month, day)
+        session.caregiver.upload_availability(d, slots)
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -408,35 +578,308 @@ def upload_availability(tokens):
         print("Error:", e)
         return
     print("Availability uploaded!")
+    match_waitlist(limit=len(slots) if slots else 1)
 
 
-def cancel(tokens):
-    global current_patient
-    global current_caregiver
-    if current_patient is None and current_caregiver is None:
-        print("Please login first.")
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def parse_weekdays(spec):
+    # "mon,wed,fri" or "mon-fri" (ranges may wrap, e.g. "sat-mon"); returns a set of date.weekday() numbers
+    days = set()
+    for part in spec.split(","):
+        if "-" in part:
+            first, last = (WEEKDAYS.index(p[:3]) for p in part.split("-", 1))
+            day = first
+            days.add(day)
+            while day != last:
+                day = (day + 1) % 7
+                days.add(day)
+        else:
+            days.add(WEEKDAYS.index(part[:3]))
+    return days
+
+
+def upload_availability_range(tokens):
+    #  upload_availability_range <start date> <end date> [weekdays] [<HH:MM>-<HH:MM>]
+    session = current_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (3, 4, 5):
+        print("Please try again!\n"
+              "Must enter 'upload_availability_range <start> <end> [weekdays] [<HH:MM>-<HH:MM>]'")
+        return
+    # the optional time window is the token with a ':' in it
+    options = tokens[3:]
+    hours = [option for option in options if ":" in option]
+    weekday_specs = [option.lower() for option in options if ":" not in option]
+    if len(hours) > 1 or len(weekday_specs) > 1:
+        print("Please try again!\n"
+              "Must enter 'upload_availability_range <start> <end> [weekdays] [<HH:MM>-<HH:MM>]'")
+        return
+    slots = None
+    if hours:
+        try:
+            slots = parse_hours(*hours[0].split("-", 1))
+        except (TypeError, ValueError):
+            print("Please enter a valid time window, e.g. 09:00-17:00")
+            return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+    except ValueError:
+        print("Please enter valid dates in the form MM-DD-YYYY!")
+        return
+    if end < start:
+        print("The end date must not be before the start date.")
+        return
+    try:
+        weekdays = parse_weekdays(weekday_specs[0]) if weekday_specs else set(range(7))
+    except ValueError:
+        print("Invalid weekdays. Use e.g. 'mon,wed,fri' or 'mon-fri'.")
         return
+
+    dates = []
+    d = start
+    while d <= end:
+        if d.weekday() in weekdays:
+            dates.append(d)
+        d += datetime.timedelta(days=1)
+
+    try:
+        inserted, skipped = session.caregiver.upload_availabilities(dates, slots)
+    except DatabaseError as e:
+        print("Upload Availability Failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when uploading availability")
+        print("Error:", e)
+        return
+    print(f"Availability uploaded! {inserted} inserted, {skipped} skipped (already uploaded).")
+    match_waitlist(limit=inserted)
+
+
+def upload_availability_file(tokens):
+    #  upload_availability_file <path>
+    #  the file holds one MM-DD-YYYY date per line, or a CSV whose first column is the date and
+    #  whose optional second and third columns are the HH:MM start and end of that day's slots
+    session = current_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
     if len(tokens) != 2:
-        print("Please enter the appointment ID to cancel your appointment.")
-    apptID = tokens[1]
+        print("Please try again!\nMust enter 'upload_availability_file <path>'")
+        return
+
+    # dates grouped by time window, so each window is one upload
+    windows = {}
+    invalid = 0
+    try:
+        with open(tokens[1], newline="") as f:
+            for row in csv.reader(f):
+                if not row or not row[0].strip():
+                    continue
+                try:
+                    d = Util.parse_date(row[0])
+                    window = (row[1].strip(), row[2].strip()) if len(row) >= 3 and row[1].strip() else None
+                    if window is not None:
+                        parse_hours(*window)
+                except ValueError:
+                    invalid += 1
+                    continue
+                windows.setdefault(window, []).append(d)
+    except OSError as e:
+        print("Could not read the availability file.")
+        print("Error:", e)
+        return
+
+    inserted = skipped = 0
+    try:
+        for window, dates in windows.items():
+            added, already = session.caregiver.upload_availabilities(dates, parse_hours(*window) if window else None)
+            inserted += added
+            skipped += already
+    except DatabaseError as e:
+        print("Upload Availability Failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when uploading availability")
+        print("Error:", e)
+        return
+    print(f"Availability uploaded! {inserted} inserted, {skipped} skipped (already uploaded), "
+          f"{invalid} invalid lines.")
+    match_waitlist(limit=inserted)
+
+
+def join_waitlist(tokens):
+    #  join_waitlist <start date> <end date> <vaccine>
+    session = current_session()
+    if session.patient is None:
+        print("Please login as a patient first!")
+        return
+
+    if len(tokens) != 4:
+        print("Please try again!\nMust enter 'join_waitlist <start date> <end date> <vaccine>'")
+        return
+
+    try:
+        start = Util.parse_date(tokens[1])
+        end = Util.parse_date(tokens[2])
+    except ValueError:
+        print("Please enter valid dates in the form MM-DD-YYYY!")
+        return
+    if end < start:
+        print("The end date must not be before the start date.")
+        return
+    vaccine_name = tokens[3].lower()
+    if not is_vaccine_name_valid(vaccine_name):
+        print("Invalid vaccine name, try again.")
+        return
+
+    username = session.patient.get_username()
     cm = ConnectionManager()
     conn = cm.create_connection()
     cursor = conn.cursor(as_dict=True)
+    try:
+        cursor.execute("SELECT apptID FROM Patients WHERE Username=%s;", username)
+        rows = cursor.fetchall()
+        if rows and rows[0]['apptID'] is not None:
+            print("You already have an appointment.\n"
+                  "To show exisiting appointments: show_appointments")
+            return
+        # joining again changes the dates and vaccine but keeps the place in line
+        cursor.execute("UPDATE Waitlist SET Name=%s, StartDate=%s, EndDate=%s WHERE Username=%s;",
+                       (vaccine_name, start, end, username))
+        if cursor.rowcount == 0:
+            cursor.execute("INSERT INTO Waitlist (Username, Name, StartDate, EndDate, JoinedAt) "
+                           "VALUES (%s, %s, %s, %s, %s);",
+                           (username, vaccine_name, start, end, datetime.datetime.now()))
+        conn.commit()
+    except DatabaseError as e:
+        print("Joining the waitlist failed")
+        print("Db-Error:", e)
+        quit()
+    finally:
+        cm.close_connection()
+    print(f"You are on the waitlist for {vaccine_name} between {tokens[1]} and {tokens[2]}.")
+
+    # there may already be room, e.g. when nobody else is waiting
+    for patient, apptID, caregiver, d, slot, name in match_waitlist(vaccine_name):
+        if patient == username:
+            print(f"Appointment ID: {apptID}, Caregiver username: {caregiver}, "
+                  f"Time: {d.month}-{d.day}-{d.year} {Util.format_time(slot)}")
+
+
+def leave_waitlist(tokens):
+    session = current_session()
+    if session.patient is None:
+        print("Please login as a patient first!")
+        return
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM Waitlist WHERE Username=%s;", session.patient.get_username())
+        removed = cursor.rowcount
+        conn.commit()
+    except DatabaseError as e:
+        print("Leaving the waitlist failed")
+        print("Db-Error:", e)
+        quit()
+    finally:
+        cm.close_connection()
+    if removed:
+        print("You have left the waitlist.")
+    else:
+        print("You are not on the waitlist.")
+
+
+def bulk_allocate(tokens):
+    #  bulk_allocate [vaccine]
+    #  books as many waitlisted patients as the open slots and doses allow, in one transaction
+    session = current_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    if len(tokens) not in (1, 2):
+        print("Please try again!\nMust enter 'bulk_allocate [vaccine]'")
+        return
+    vaccine_name = tokens[1].lower() if len(tokens) == 2 else None
+    if vaccine_name is not None and not is_vaccine_name_valid(vaccine_name):
+        print("Invalid vaccine name, try again.")
+        return
+
+    started = time.perf_counter()
+    matches = match_waitlist(vaccine_name, limit=None)
+    elapsed = time.perf_counter() - started
+    if not matches:
+        print("No waitlisted patients could be given an appointment.")
+        return
+    per_caregiver = {}
+    for _, _, caregiver, _, _, _ in matches:
+        per_caregiver[caregiver] = per_caregiver.get(caregiver, 0) + 1
+    for caregiver, count in sorted(per_caregiver.items()):
+        print(f"{caregiver} {count}")
+    print(f"Allocated {len(matches)} appointments across {len(per_caregiver)} caregivers in {elapsed:.2f}s.")
+
+
+def match_waitlist(vaccine_name=None, limit=1):
+    # offer capacity that was just freed or added to waitlisted patients; returns the matches made
+    try:
+        matches = WaitlistMatcher().match(vaccine_name, limit)
+    except DatabaseError as e:
+        print("Waitlist matching failed")
+        print("Db-Error:", e)
+        return []
+    for _, _, _, _, _, name in matches:
+        vaccine_cache.adjust(name, -1)
+    if matches:
+        print(f"{len(matches)} waitlisted patient(s) were given an appointment.")
+    return matches
+
+
+def cancel(tokens):
+    session = current_session()
+    if session.patient is None and session.caregiver is None:
+        print("Please login first.")
+        return
+    if len(tokens) != 2:
+        print("Please enter the appointment ID to cancel your appointment.")
+        return
+    try:
+        # appointment IDs are integers; compare as one so the lookup can use the apptID index
+        apptID = int(tokens[1])
+    except ValueError:
+        apptID = None
 
+    if apptID is None:
+        print_no_appointment()
+        return
+    if procedures.enabled:
+        cancel_procedure(session, apptID)
+        return
     if not appt_reserved(apptID):
-        print("There is no appointment with this appointment ID.\n"
-              "Please ensure appointment ID is correct.\n"
-              "To show an existing appointment and ID, use 'show_appointments'")
+        print_no_appointment()
         return
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor(as_dict=True)
     try:
-        get_vaccine_name = "SELECT Name FROM Availabilities WHERE apptID=%s;"
-        cursor.execute(get_vaccine_name, apptID)
+        get_appointment = "SELECT Name, Time, Slot, Username FROM Availabilities WHERE apptID=%s;"
+        cursor.execute(get_appointment, apptID)
         for row in cursor:
-            vaccine_name = row['Name']
-        if current_patient: # For patients: make the appointment available again
+            appointment = row
+        vaccine_name = appointment['Name']
+        if session.patient: # For patients: make the appointment available again
             cancel_appt = "UPDATE Availabilities SET apptID=NULL, Name=NULL WHERE apptID=%s;"
             cursor.execute(cancel_appt, apptID)
-            patient = current_patient.get_username()
+            patient = session.patient.get_username()
         else: # For caregivers: remove the time slot from availability
             get_pt_name = "SELECT p.Username Patient FROM Availabilities a JOIN Patients p ON a.apptID=p.apptID " \
                           "WHERE a.apptID=%s;"
@@ -448,32 +891,66 @@ def cancel(tokens):
         delete_apptID = "UPDATE Patients SET apptID = NULL WHERE Username=%s;"
         cursor.execute(delete_apptID, patient)
 
-        # Add vaccine dose back to inventory
-        increment_doses(vaccine_name, decrease=False)
+        # kept for the cancellations report
+        record_cancellation = "INSERT INTO Cancellations (apptID, Time, Slot, Caregiver, Patient, Name, CancelledBy, " \
+                              "CancelledAt) VALUES (%s, %s, %d, %s, %s, %s, %s, %s);"
+        cursor.execute(record_cancellation, (apptID, appointment['Time'], appointment['Slot'], appointment['Username'],
+                                             patient, vaccine_name, "patient" if session.patient else "caregiver",
+                                             datetime.datetime.now()))
+
+        # Add vaccine dose back to inventory, in the same transaction as the cancellation
+        dose_ledger.credit(cursor, vaccine_name, 1, "cancel", apptID)
         conn.commit()
+        vaccine_cache.adjust(vaccine_name, 1)
         print(f"Appointment successfully cancelled.")
-        cm.close_connection()
     except:
         print(f"An error occurred. Appointment {apptID} was not cancelled. Try again.")
         return
+    finally:
+        cm.close_connection()
+    match_waitlist(vaccine_name)
+
+
+def cancel_procedure(session, apptID):
+    # the CancelAppointment procedure checks the appointment is this user's and cancels it in one round trip
+    cancelled_by = "patient" if session.patient else "caregiver"
+    user = session.patient.get_username() if session.patient else session.caregiver.get_username()
+    try:
+        status, vaccine_name = procedures.call("CancelAppointment", (apptID, user, cancelled_by,
+                                                                     datetime.datetime.now()))
+    except Exception:
+        print(f"An error occurred. Appointment {apptID} was not cancelled. Try again.")
+        return
+    if status != OK:
+        print_no_appointment()
+        return
+    vaccine_cache.adjust(vaccine_name, 1)
+    print(f"Appointment successfully cancelled.")
+    match_waitlist(vaccine_name)
+
+
+def print_no_appointment():
+    print("There is no appointment with this appointment ID.\n"
+          "Please ensure appointment ID is correct.\n"
+          "To show an existing appointment and ID, use 'show_appointments'")
+
 
 def appt_reserved(apptID):
-    global current_caregiver
-    global current_patient
+    session = current_session()
 
     cm = ConnectionManager()
     conn = cm.create_connection()
     cursor = conn.cursor(as_dict=True)
     try:
-        if current_caregiver:
+        if session.caregiver:
             get_appointment = "SELECT * FROM Availabilities WHERE apptID=%s AND Username=%s;"
-            user = current_caregiver.get_username()
+            user = session.caregiver.get_username()
         else:
             get_appointment = "SELECT * FROM Availabilities a JOIN Patients p " \
                               "ON a.apptID = p.apptID WHERE a.apptID=%s AND p.Username=%s;"
-            user = current_patient.get_username()
+            user = session.patient.get_username()
         cursor.execute(get_appointment, (apptID, user))
-        return cursor.rowcount != 0
+        return len(cursor.fetchall()) != 0
     except Exception as e:
         print(e)
         print("An error occurred.")
@@ -482,48 +959,14 @@ def appt_reserved(apptID):
         cm.close_connection()
 
 
-def increment_doses(vaccine_name, decrease=True):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
-    try:
-        if decrease:
-            change_doses = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name=%s AND Doses>0;"
-        else:
-            change_doses = "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name=%s;"
-        cursor.execute(change_doses, vaccine_name)
-        conn.commit()
-    except pymssql.Error as e:
-        print("Error occurred when incrementing doses")
-        print("Db-Error:", e)
-        quit()
-    except Exception as e:
-        print("Error occurred when incrementing doses")
-        print("Error:", e)
-        return
-    finally:
-        cm.close_connection()
-
 def is_vaccine_name_valid(vaccine_name):
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor(as_dict=True)
-    try:
-        statement = "SELECT COUNT(*) AS total FROM Vaccines WHERE Name=%s;"
-        cursor.execute(statement, vaccine_name)
-        isValid = False
-        for row in cursor:
-            isValid = row['total'] != 0
-        cm.close_connection()
-        return isValid
-    except Exception:
-        print("An error occurred.")
+    return vaccine_cache.is_valid(vaccine_name)
 
 def add_doses(tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    session = current_session()
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -532,7 +975,7 @@ def add_doses(tokens):
         print("Please try again!")
         return
 
-    vaccine_name = tokens[1]
+    vaccine_name = tokens[1].lower()
     try:
         doses = int(tokens[2])
     except:
@@ -541,7 +984,7 @@ def add_doses(tokens):
     vaccine = None
     try:
         vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
         quit()
@@ -556,7 +999,7 @@ def add_doses(tokens):
         vaccine = Vaccine(vaccine_name, doses)
         try:
             vaccine.save_to_db()
-        except pymssql.Error as e:
+        except DatabaseError as e:
             print("Error occurred when adding doses")
             print("Db-Error:", e)
             quit()
@@ -568,7 +1011,7 @@ def add_doses(tokens):
         # if the vaccine is not null, meaning that the vaccine already exists in our table
         try:
             vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
+        except DatabaseError as e:
             print("Error occurred when adding doses")
             print("Db-Error:", e)
             quit()
@@ -577,53 +1020,128 @@ def add_doses(tokens):
             print("Error:", e)
             return
     print("Doses updated!")
+    match_waitlist(vaccine_name, doses)
 
 
 def show_appointments(tokens):
-    global current_patient
-    global current_caregiver
-    if current_caregiver is None and current_patient is None:
+    # show_appointments [--limit N] [--after <appointment ID>] [--from <date>] [--to <date>]
+    session = current_session()
+    if session.caregiver is None and session.patient is None:
         print("Please login first!")
         return
     try:
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        if current_caregiver:
-            get_appointments = "SELECT a.apptID, Name, Time, Username " \
-                               "FROM (SELECT apptID, Time, Name FROM Availabilities WHERE Username=%s) a " \
-                               "JOIN Patients p ON p.apptID = a.apptID ORDER BY a.apptID"
+        positional, options = parse_page_options(tokens[1:], "--limit", "--after", "--from", "--to")
+        if positional:
+            raise ValueError(positional[0])
+        after = int(options["--after"]) if "--after" in options else None
+        start = Util.parse_date(options["--from"]) if "--from" in options else None
+        end = Util.parse_date(options["--to"]) if "--to" in options else None
+    except ValueError:
+        print("Invalid option. Use --limit <number>, --after <appointment ID>, --from <date> and --to <date>.")
+        return
+    limit = options.get("--limit")
 
-            cursor.execute(get_appointments, current_caregiver.get_username())
-        else:
-            get_appointments = "SELECT a.apptID, Name, Time, a.Username "\
-                               "FROM (SELECT Username, apptID from Patients) p JOIN " \
-                               "(SELECT apptID, Name, Time, Username FROM Availabilities) a " \
-                               "ON p.apptID = a.apptID " \
-                               "WHERE p.Username = %s"
-            cursor.execute(get_appointments, current_patient.get_username())
-        if cursor.rowcount == 0:
-            print("There are no appointments scheduled.")
-            return
-        for row in cursor:
-            print(f"{row['apptID']} {row['Name']} {row['Time'].month}-{row['Time'].day}-{row['Time'].year} "
-                  f"{row['Username']}")
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor(as_dict=True)
+    try:
+        cursor.execute(*appointments_query(session, cm.backend, limit, after, start, end))
+        print_appointments(cursor.stream(), limit, options)
     except Exception as e:
         print(e)
         print("Please try again!")
+    finally:
+        cm.close_connection()
 
 
+def report(tokens):
+    # report <utilization|burndown|cancellations> [--from <date>] [--to <date>] [--format csv|json] [--out <file>]
+    session = current_session()
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+    # loaded on first use, since it brings in numpy
+    from report.Report import REPORTS
+    try:
+        positional, options = parse_page_options(tokens[1:], "--from", "--to", "--format", "--out")
+        start = Util.parse_date(options["--from"]) if "--from" in options else None
+        end = Util.parse_date(options["--to"]) if "--to" in options else None
+        output_format = options.get("--format", "csv").lower()
+        name = positional[0].lower() if len(positional) == 1 else None
+        if name not in REPORTS or output_format not in ("csv", "json"):
+            raise ValueError(tokens)
+    except ValueError:
+        print("Please try again!\nMust enter 'report <utilization|burndown|cancellations> [--from <date>] "
+              "[--to <date>] [--format csv|json] [--out <file>]'")
+        return
+
+    try:
+        result = REPORTS[name](start, end)
+        if "--out" in options:
+            with open(options["--out"], "w", newline="") as f:
+                result.write(f, output_format)
+            print(f"Report written to {options['--out']} ({len(result)} rows).")
+        else:
+            result.write(sys.stdout, output_format)
+    except DatabaseError as e:
+        print("Error occurred when building the report")
+        print("Db-Error:", e)
+    except Exception as e:
+        print("Error occurred when building the report")
+        print("Error:", e)
+
+
+def appointments_query(session, backend=None, limit=None, after=None, start=None, end=None):
+    # (query, params) listing the logged-in user's appointments in appointment ID order, optionally
+    # between two dates and keyset-paginated by appointment ID (one row past limit is asked for)
+    if session.caregiver:
+        query = "SELECT a.apptID, a.Name, a.Time, a.Slot, p.Username " \
+                "FROM Availabilities a JOIN Patients p ON p.apptID = a.apptID WHERE a.Username = %s"
+        params = (session.caregiver.get_username(),)
+    else:
+        query = "SELECT a.apptID, a.Name, a.Time, a.Slot, a.Username " \
+                "FROM Patients p JOIN Availabilities a ON a.apptID = p.apptID WHERE p.Username = %s"
+        params = (session.patient.get_username(),)
+    if after is not None:
+        query += " AND a.apptID > %s"
+        params += (after,)
+    if start is not None:
+        query += " AND a.Time >= %s"
+        params += (start,)
+    if end is not None:
+        query += " AND a.Time <= %s"
+        params += (end,)
+    query += " ORDER BY a.apptID"
+    if limit is not None:
+        query = backend.first_rows(query, limit + 1)
+    return query, params
+
+
+def print_appointments(rows, limit=None, options=None):
+    shown = 0
+    last = None
+    for row in rows:
+        if limit is not None and shown == limit:
+            # the next page repeats this command's options, with --after moved on
+            repeated = " ".join(f"{name} {value}" for name, value in options.items() if name != "--after")
+            print(f"... more: show_appointments {repeated} --after {last}")
+            break
+        print(f"{row['apptID']} {row['Name']} {row['Time'].month}-{row['Time'].day}-{row['Time'].year} "
+              f"{Util.format_time(row['Slot'])} {row['Username']}")
+        last = row['apptID']
+        shown += 1
+    if shown == 0:
+        print("There are no appointments scheduled.")
+
 
 def logout(tokens):
-    global current_patient
-    global current_caregiver
+    session = current_session()
     try:
-        if current_patient is None and current_caregiver is None:
+        if session.patient is None and session.caregiver is None:
             print("Please login first.")
             return
-        current_patient = None
-        current_caregiver = None
+        session.patient = None
+        session.caregiver = None
         print("Successfully logged out!")
         return
     except Exception:
@@ -636,18 +1154,64 @@ def print_menu():
     print(" *** Please enter one of the following commands *** ")
     print("> create_patient <username> <password>")
     print("> create_caregiver <username> <password>")
+    print("> import_patients <file> [--workers N]")
+    print("> import_caregivers <file> [--workers N]")
     print("> login_patient <username> <password>")
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")
-    print("> reserve <date> <vaccine>")
-    print("> upload_availability <date>")
+    print("> search_caregiver_schedule <date> [<end date>] [--limit N] [--after <caregiver or date>]")
+    print("> reserve <date> <vaccine> [<time>]")
+    print("> upload_availability <date> [<start time> <end time>]")
+    print("> upload_availability_range <start date> <end date> [weekdays] [<start time>-<end time>]")
+    print("> upload_availability_file <path>")
+    print("> join_waitlist <start date> <end date> <vaccine>")
+    print("> leave_waitlist")
+    print("> bulk_allocate [vaccine]")
     print("> cancel <appointment_id>")
     print("> add_doses <vaccine> <number>")
-    print("> show_appointments")
+    print("> show_appointments [--limit N] [--after <appointment ID>] [--from <date>] [--to <date>]")
+    print("> report <utilization|burndown|cancellations> [--from <date>] [--to <date>] [--format csv|json] [--out <file>]")
     print("> logout")
     print("> Quit")
     print()
 
+COMMANDS = {
+    "create_patient": create_patient,
+    "create_caregiver": create_caregiver,
+    "import_patients": import_patients,
+    "import_caregivers": import_caregivers,
+    "login_patient": login_patient,
+    "login_caregiver": login_caregiver,
+    "search_caregiver_schedule": search_caregiver_schedule,
+    "reserve": reserve,
+    "upload_availability": upload_availability,
+    "upload_availability_range": upload_availability_range,
+    "upload_availability_file": upload_availability_file,
+    "join_waitlist": join_waitlist,
+    "leave_waitlist": leave_waitlist,
+    "bulk_allocate": bulk_allocate,
+    "cancel": cancel,
+    "add_doses": add_doses,
+    "show_appointments": show_appointments,
+    "report": report,
+    "logout": logout,
+}
+
+
+def dispatch(tokens):
+    # runs one command; returns False once the user quits
+    operation = tokens[0]
+    if operation == "quit":
+        print("Bye!")
+        return False
+    handler = COMMANDS.get(operation)
+    if handler is None:
+        print("Invalid operation name!")
+    else:
+        with instrumentation.command(operation):
+            handler(tokens)
+    return True
+
+
 def start():
     stop = False
     while not stop:
@@ -660,55 +1224,137 @@ def start():
         except ValueError:
             print("Please try again!")
             break
+        except EOFError:
+            print("Bye!")
+            break
 
-        response = response.lower()
+        # only the operation name is case-insensitive; arguments such as file paths are kept as typed
         tokens = response.split(" ")
+        tokens[0] = tokens[0].lower()
         if len(tokens) == 0:
             ValueError("Please try again!")
             continue
-        operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == cancel:
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "cancel":
-            cancel(tokens)
-        elif operation == "quit":
-            print("Bye!")
-            stop = True
-        else:
-            print("Invalid operation name!")
+        stop = not dispatch(tokens)
 
 
+def run_batch(lines, group_size=0, transactional=False, timing=False):
+    """
+    Run commands from an iterable of lines without the menu. Blank lines and lines starting
+    with # are skipped. With group_size > 0, every group_size consecutive commands share one
+    connection (and, if transactional, one transaction; see SharedConnection).
+    Returns {operation: [seconds, ...]} for every command that ran.
+    """
+    timings = {}
+    group = None
+    in_group = 0
+    try:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            tokens = line.split()
+            tokens[0] = tokens[0].lower()
+
+            if group_size > 0 and group is None:
+                group = SharedConnection(transactional=transactional)
+                group.__enter__()
+
+            started = time.perf_counter()
+            if group is not None:
+                with group.command():
+                    keep_going = dispatch(tokens)
+            else:
+                keep_going = dispatch(tokens)
+            timings.setdefault(tokens[0], []).append(time.perf_counter() - started)
+
+            if group is not None:
+                in_group += 1
+                if in_group >= group_size:
+                    group.__exit__(None, None, None)
+                    group = None
+                    in_group = 0
+            if not keep_going:
+                break
+    except BaseException as e:
+        if group is not None:
+            group.__exit__(type(e), e, e.__traceback__)
+            group = None
+            # the cache may hold dose changes from the rolled back transaction
+            vaccine_cache.invalidate()
+        raise
+    finally:
+        if group is not None:
+            group.__exit__(None, None, None)
+        if timing:
+            print_timing_summary(timings)
+    return timings
 
-if __name__ == "__main__":
+
+def print_timing_summary(timings):
+    print()
+    print(f"{'command':<28}{'count':>7}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for operation, samples in sorted(timings.items()):
+        samples = sorted(samples)
+        total = sum(samples)
+        p50 = samples[int(0.50 * (len(samples) - 1))]
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        print(f"{operation:<28}{len(samples):>7}{total * 1000:>12.1f}{total / len(samples) * 1000:>10.2f}"
+              f"{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{samples[-1] * 1000:>10.2f}")
+
+
+def main(argv=None):
     '''
     // pre-define the three types of authorized vaccines
     // note: it's a poor practice to hard-code these values, but we will do this ]
     // for the simplicity of this assignment
     // and then construct a map of vaccineName -> vaccineObject
     '''
+    parser = argparse.ArgumentParser(description="COVID-19 Vaccine Reservation Scheduling Application")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) without the interactive menu")
+    parser.add_argument("--group", type=int, default=0, metavar="N",
+                        help="batch mode: share one database connection across every N commands")
+    parser.add_argument("--transaction", action="store_true",
+                        help="batch mode: run each group of commands in a single transaction")
+    parser.add_argument("--timing", action="store_true", help="batch mode: print a per-command timing summary")
+    parser.add_argument("--stats", action="store_true",
+                        help="print database round trips and time per command, and slow queries, on exit")
+    parser.add_argument("--metrics", metavar="FILE", help="write database metrics in Prometheus text format on exit")
+    parser.add_argument("--serve", action="store_true", help="serve many sessions over TCP instead of the menu")
+    parser.add_argument("--host", default="127.0.0.1", help="server mode: address to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="server mode: port to listen on")
+    parser.add_argument("--workers", type=int, default=16, help="server mode: command worker threads")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="server mode: run commands as coroutines on one event loop instead of worker threads")
+    args = parser.parse_args(argv)
 
-    # start command line
-    print()
-    print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+    try:
+        if args.serve:
+            from Server import serve
+            dispatch_async = None
+            if args.use_async:
+                from AsyncScheduler import dispatch_async
+            serve(dispatch, args.host, args.port, args.workers, dispatch_async)
+        elif args.batch:
+            if args.batch == "-":
+                run_batch(sys.stdin, args.group, args.transaction, args.timing)
+            else:
+                with open(args.batch) as f:
+                    run_batch(f, args.group, args.transaction, args.timing)
+        else:
+            # start command line
+            print()
+            print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+
+            start()
+    finally:
+        if args.stats:
+            print()
+            print(instrumentation.report())
+        if args.metrics:
+            with open(args.metrics, "w") as f:
+                f.write(instrumentation.prometheus())
 
-    start()
+
+if __name__ == "__main__":
+    main()
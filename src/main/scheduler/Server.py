@@ -0,0 +1,120 @@
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from Session import Session, activate, deactivate, install_session_stdout
+
+
+PROMPT = "> "
+
+
+def run_command(dispatch, session, tokens):
+    """
+    Run one command for session on the calling (worker) thread and return (output, keep_going).
+    The handlers are the same blocking functions the command line uses; they print, and
+    SessionStdout sends what they print to this session's buffer.
+    """
+    token = activate(session)
+    session.output = io.StringIO()
+    try:
+        keep_going = dispatch(tokens)
+    except SystemExit:
+        # handlers quit() on database errors; that must not take the server down
+        print("A database error occurred. Please try again.")
+        keep_going = True
+    except Exception as e:
+        print("An error occurred. Please try again.")
+        print("Error:", e)
+        keep_going = True
+    finally:
+        output = session.output.getvalue()
+        session.output = None
+        deactivate(token)
+    return output, keep_going
+
+
+async def run_command_async(dispatch_async, session, tokens):
+    """
+    Same as run_command, for the async handlers: the command runs on the event loop and
+    only its database work leaves it (see AsyncDatabase).
+    """
+    token = activate(session)
+    session.output = io.StringIO()
+    try:
+        keep_going = await dispatch_async(tokens)
+    except SystemExit:
+        print("A database error occurred. Please try again.")
+        keep_going = True
+    except Exception as e:
+        print("An error occurred. Please try again.")
+        print("Error:", e)
+        keep_going = True
+    finally:
+        output = session.output.getvalue()
+        session.output = None
+        deactivate(token)
+    return output, keep_going
+
+
+class SchedulerServer:
+    """
+    Line-oriented TCP front end: each client connection gets its own Session, and its
+    commands run one at a time on a shared worker thread pool (which in turn borrows from
+    the shared database connection pool). With dispatch_async, commands instead run as
+    coroutines on the event loop itself.
+    """
+
+    def __init__(self, dispatch, host="127.0.0.1", port=8765, workers=16, dispatch_async=None):
+        self.dispatch = dispatch
+        self.dispatch_async = dispatch_async
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler-worker")
+        self.sessions = 0
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session = Session()
+        self.sessions += 1
+        try:
+            writer.write(("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!\n" + PROMPT).encode())
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tokens = line.decode("utf-8", errors="replace").strip().split(" ")
+                tokens[0] = tokens[0].lower()
+                if not tokens[0]:
+                    writer.write(PROMPT.encode())
+                    await writer.drain()
+                    continue
+                if self.dispatch_async is not None:
+                    output, keep_going = await run_command_async(self.dispatch_async, session, tokens)
+                else:
+                    output, keep_going = await loop.run_in_executor(self.executor, run_command, self.dispatch,
+                                                                    session, tokens)
+                writer.write(output.encode())
+                if not keep_going:
+                    await writer.drain()
+                    break
+                writer.write(PROMPT.encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    async def serve_forever(self):
+        install_session_stdout()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"Serving on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(dispatch, host="127.0.0.1", port=8765, workers=16, dispatch_async=None):
+    try:
+        asyncio.run(SchedulerServer(dispatch, host, port, workers, dispatch_async).serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,59 @@
+import contextvars
+import sys
+
+
+class Session:
+    """
+    Per-user state: who is logged in.
+    Note: it is always true that at most one of caregiver and patient is not None,
+          since only one user can be logged in per session at a time.
+    """
+
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+        # when set, everything the command handlers print goes here instead of stdout
+        self.output = None
+
+
+# the command line uses a single default session; the server gives each client its own
+_default_session = Session()
+_current_session = contextvars.ContextVar("current_session", default=None)
+
+
+def current_session():
+    session = _current_session.get()
+    return session if session is not None else _default_session
+
+
+def activate(session):
+    # make session current in this context; pass the returned token to deactivate()
+    return _current_session.set(session)
+
+
+def deactivate(token):
+    _current_session.reset(token)
+
+
+class SessionStdout:
+    """Routes print() output to the current session's buffer when it has one."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        session = _current_session.get()
+        if session is not None and session.output is not None:
+            return session.output.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def install_session_stdout():
+    if not isinstance(sys.stdout, SessionStdout):
+        sys.stdout = SessionStdout(sys.stdout)
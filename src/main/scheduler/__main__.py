@@ -0,0 +1,4 @@
+# lets the directory run as a program: python src/main/scheduler [options]
+from Scheduler import main
+
+main()
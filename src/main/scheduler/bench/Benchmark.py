@@ -0,0 +1,243 @@
+"""
+End-to-end benchmark of the scheduler's command paths.
+
+Seeds caregivers, availability and vaccines through the model classes, then drives
+the real command handlers (create_patient, login_patient, search_caregiver_schedule,
+reserve, show_appointments, cancel, add_doses, ...) from concurrent sessions against a
+throwaway SQLite database. Reports p50/p95/p99 latency, throughput and database round
+trips per command, and writes the results as JSON.
+
+Run from src/main/scheduler:
+
+    python -m bench.Benchmark --patients 500 --concurrency 16 --out bench.json
+    python -m bench.Benchmark --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Recorder:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, operation, seconds, round_trips):
+        with self._lock:
+            self.samples.setdefault(operation, []).append((seconds, round_trips))
+
+    def summary(self, wall_time):
+        commands = {}
+        for operation, samples in sorted(self.samples.items()):
+            latencies = sorted(seconds for seconds, _ in samples)
+            trips = sum(round_trips for _, round_trips in samples)
+            commands[operation] = {
+                "count": len(samples),
+                "mean_ms": sum(latencies) / len(latencies) * 1000,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": latencies[-1] * 1000,
+                "throughput_per_s": len(samples) / wall_time if wall_time else 0.0,
+                "round_trips_per_command": trips / len(samples),
+            }
+        return commands
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run(recorder, session, tokens):
+    from Scheduler import dispatch
+    from Server import run_command
+    from db.Instrumentation import instrumentation
+
+    trips_before = instrumentation.round_trips()
+    started = time.perf_counter()
+    output, _ = run_command(dispatch, session, tokens)
+    recorder.add(tokens[0], time.perf_counter() - started, instrumentation.round_trips() - trips_before)
+    return output
+
+
+def seed(args, dates):
+    from Scheduler import parse_hours
+    from model.Caregiver import Caregiver
+    from model.Vaccine import Vaccine
+    from util.Util import Util
+
+    slots = parse_hours(*args.hours.split("-", 1)) if args.hours else None
+    caregivers = []
+    for i in range(args.caregivers):
+        salt = Util.generate_salt()
+        caregiver = Caregiver(f"bench_cg{i}", salt=salt, hash=Util.generate_hash("pw", salt))
+        caregiver.save_to_db()
+        caregiver.upload_availabilities(dates, slots)
+        caregivers.append(caregiver.get_username())
+    vaccines = [f"bench_vaccine{i}" for i in range(args.vaccines)]
+    for name in vaccines:
+        Vaccine(name, args.doses).save_to_db()
+    return caregivers, vaccines
+
+
+def patient_workflow(recorder, i, dates, vaccines, cancel_rate):
+    from Session import Session
+
+    rng = random.Random(i)
+    session = Session()
+    username = f"bench_p{i}"
+    d = rng.choice(dates)
+    date = f"{d.month}-{d.day}-{d.year}"
+
+    run(recorder, session, ["create_patient", username, "pw"])
+    run(recorder, session, ["login_patient", username, "pw"])
+    run(recorder, session, ["search_caregiver_schedule", date])
+    output = run(recorder, session, ["reserve", date, rng.choice(vaccines)])
+    run(recorder, session, ["show_appointments"])
+    match = re.search(r"Appointment ID: (\S+),", output)
+    if match and rng.random() < cancel_rate:
+        run(recorder, session, ["cancel", match.group(1)])
+    run(recorder, session, ["logout"])
+
+
+def caregiver_workflow(recorder, username, vaccines):
+    from Session import Session
+
+    session = Session()
+    run(recorder, session, ["login_caregiver", username, "pw"])
+    for name in vaccines:
+        run(recorder, session, ["add_doses", name, "1"])
+    run(recorder, session, ["show_appointments"])
+    run(recorder, session, ["logout"])
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline.get('revision')}):")
+    print(f"{'command':<28}{'p95 ms':>10}{'before':>10}{'change':>9}{'trips':>8}{'before':>8}")
+    for operation, now in results["commands"].items():
+        before = baseline["commands"].get(operation)
+        if before is None:
+            continue
+        change = (now["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        print(f"{operation:<28}{now['p95_ms']:>10.2f}{before['p95_ms']:>10.2f}{change:>8.1f}%"
+              f"{now['round_trips_per_command']:>8.1f}{before['round_trips_per_command']:>8.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scheduler's command paths")
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--days", type=int, default=30, help="days of availability per caregiver")
+    parser.add_argument("--hours", help="publish each day as slots in this HH:MM-HH:MM window "
+                                         "(default: one slot per day)")
+    parser.add_argument("--vaccines", type=int, default=3)
+    parser.add_argument("--doses", type=int, default=10000, help="initial doses per vaccine")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--cancel-rate", type=float, default=0.3, help="share of bookings that are cancelled")
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="JSON", help="print the change against an earlier results file")
+    args = parser.parse_args(argv)
+
+    tmpdir = None
+    if args.db is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.db = os.path.join(tmpdir.name, "bench.db")
+    os.environ["Backend"] = "sqlite"
+    os.environ["SqliteDB"] = args.db
+    os.environ.setdefault("PoolSize", str(max(10, args.concurrency + 2)))
+
+    from Session import install_session_stdout
+    from db.ConnectionManager import get_pool
+    from db.Instrumentation import instrumentation
+    from model.CredentialCache import credential_cache
+    from model.VaccineCache import vaccine_cache
+    from db.DoseLedger import dose_ledger
+
+    # command output goes to each session's buffer, not the terminal
+    install_session_stdout()
+
+    first_day = datetime.date.today() + datetime.timedelta(days=1)
+    dates = [first_day + datetime.timedelta(days=i) for i in range(args.days)]
+    seed_started = time.perf_counter()
+    caregivers, vaccines = seed(args, dates)
+    seed_time = time.perf_counter() - seed_started
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(patient_workflow, recorder, i, dates, vaccines, args.cancel_rate)
+                   for i in range(args.patients)]
+        futures += [executor.submit(caregiver_workflow, recorder, username, vaccines) for username in caregivers]
+        for future in futures:
+            future.result()
+    wall_time = time.perf_counter() - started
+
+    commands = recorder.summary(wall_time)
+    total = sum(c["count"] for c in commands.values())
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "db")},
+        "seed_seconds": seed_time,
+        "wall_seconds": wall_time,
+        "commands_total": total,
+        "throughput_per_s": total / wall_time if wall_time else 0.0,
+        "commands": commands,
+        "pool": get_pool().stats(),
+        "vaccine_cache": vaccine_cache.stats(),
+        "credential_cache": credential_cache.stats(),
+        "instrumentation": instrumentation.snapshot(),
+        # vaccines whose dose counters do not add up to their balance plus ledger; should be empty
+        "dose_ledger_mismatches": dose_ledger.check(),
+    }
+
+    print(f"{total} commands in {wall_time:.2f}s ({results['throughput_per_s']:.1f}/s), "
+          f"concurrency {args.concurrency}, seeded in {seed_time:.2f}s")
+    print(f"{'command':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'trips':>8}")
+    for operation, c in commands.items():
+        print(f"{operation:<28}{c['count']:>7}{c['p50_ms']:>10.2f}{c['p95_ms']:>10.2f}{c['p99_ms']:>10.2f}"
+              f"{c['throughput_per_s']:>10.1f}{c['round_trips_per_command']:>8.1f}")
+
+    for name, counters, balance, ledger in results["dose_ledger_mismatches"]:
+        print(f"DOSE MISMATCH {name}: counters {counters} != balance {balance} + ledger {ledger}")
+
+    if args.compare:
+        compare(args.compare, results)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if tmpdir is not None:
+        get_pool().close_all()
+        tmpdir.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
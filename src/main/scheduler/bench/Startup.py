@@ -0,0 +1,96 @@
+"""
+Startup-time benchmark and import budget check for one-shot invocations.
+
+Times whole processes running a single batch command (by default just "quit", i.e. pure
+startup) through the package entry point, and measures the import of Scheduler with
+python -X importtime. Exits with status 1 if the import takes longer than --budget-ms,
+or if it loads a module that only some commands need (database drivers, numpy, asyncio).
+
+Run from src/main/scheduler:
+
+    python -m bench.Startup --runs 20
+    python -m bench.Startup --budget-ms 100 --batch commands.txt
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SCHEDULER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# loaded on first use by the commands that need them, never on startup
+DEFERRED_MODULES = ("pymssql", "sqlite3", "numpy", "asyncio", "concurrent.futures", "report.Report")
+
+
+def time_runs(runs, batch, env):
+    # wall-clock seconds of each complete process, entry point to exit
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        if batch is None:
+            subprocess.run([sys.executable, SCHEDULER_DIR, "--batch", "-"], input="quit\n", text=True,
+                           capture_output=True, env=env, check=True)
+        else:
+            subprocess.run([sys.executable, SCHEDULER_DIR, "--batch", batch], capture_output=True, env=env,
+                           check=True)
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def import_profile(env):
+    # (cumulative microseconds per module, in import order) for "import Scheduler"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import Scheduler"], cwd=SCHEDULER_DIR,
+                            capture_output=True, text=True, env=env, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the scheduler's startup time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--batch", metavar="FILE", help="command file each run executes (default: quit)")
+    parser.add_argument("--budget-ms", type=float, default=100.0,
+                        help="fail if importing Scheduler takes longer (best of --runs)")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.TemporaryDirectory()
+    env = dict(os.environ)
+    env.setdefault("Backend", "sqlite")
+    env.setdefault("SqliteDB", os.path.join(tmpdir.name, "startup.db"))
+    # start from compiled modules, as an installed copy would
+    subprocess.run([sys.executable, "-m", "compileall", "-q", SCHEDULER_DIR], check=True)
+
+    times = time_runs(args.runs, args.batch, env)
+    profiles = [import_profile(env) for _ in range(args.runs)]
+    import_ms = min(p.get("Scheduler", 0) for p in profiles) / 1000
+    deferred = sorted(m for m in DEFERRED_MODULES if any(m in p for p in profiles))
+    tmpdir.cleanup()
+
+    print(f"process: min {min(times) * 1000:.1f} ms, median {statistics.median(times) * 1000:.1f} ms, "
+          f"max {max(times) * 1000:.1f} ms over {args.runs} runs")
+    print(f"import Scheduler: {import_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    slowest = sorted(profiles[0].items(), key=lambda item: item[1], reverse=True)[1:6]
+    print("largest imports: " + ", ".join(f"{name} {us / 1000:.1f} ms" for name, us in slowest))
+
+    failed = False
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import took {import_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if deferred:
+        print("FAIL: loaded on startup: " + ", ".join(deferred))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
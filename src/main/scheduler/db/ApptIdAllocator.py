@@ -0,0 +1,93 @@
+import os
+import threading
+from db.ConnectionManager import ConnectionManager
+from db.StorageBackend import DatabaseError
+
+
+class ApptIdAllocator:
+    """
+    Hands out unique, increasing appointment IDs.
+
+    Each process reserves a block of block_size IDs with one UPDATE on the ApptIDSequence
+    row, then serves IDs from memory until the block runs out. Blocks never overlap, so
+    IDs are unique across processes without a check or retry; unused IDs at the end of a
+    block are simply skipped. IDs start above the 8-digit range used by the old random IDs.
+
+    Blocks are reserved and committed on a connection of their own, outside any batch group
+    (see SharedConnection), so the sequence row is never locked for a whole group and a
+    group that rolls back cannot take back a block that is already being served. On SQLite
+    a group's transaction locks the whole database, so a second connection would wait for
+    the group itself; there the block is reserved in the group and dropped if it rolls back.
+    """
+
+    SEQUENCE = "apptID"
+
+    def __init__(self, block_size=100, first_id=100000000):
+        self.block_size = block_size
+        self.first_id = first_id
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def next_id(self):
+        # call outside any open transaction of the caller's own; a batch group is fine
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve_block()
+            apptID = self._next
+            self._next += 1
+            return apptID
+
+    def next_ids(self, n):
+        # n IDs at once, e.g. for a bulk assignment; the same rule about transactions applies
+        with self._lock:
+            ids = list(range(self._next, min(self._end, self._next + n)))
+            self._next += len(ids)
+            if len(ids) < n:
+                # one reservation big enough for the rest
+                self._next, self._end = self._reserve_block(max(self.block_size, n - len(ids)))
+                more = n - len(ids)
+                ids.extend(range(self._next, self._next + more))
+                self._next += more
+        return ids
+
+    def _reserve_block(self, size=None):
+        size = size or self.block_size
+        cm = ConnectionManager()
+        conn = cm.create_connection(shared=cm.backend.locks_database)
+        cursor = conn.cursor()
+        try:
+            for _ in range(2):
+                cursor.execute("UPDATE ApptIDSequence SET NextID = NextID + %d WHERE Name = %s;",
+                               (size, self.SEQUENCE))
+                if cursor.rowcount == 1:
+                    cursor.execute("SELECT NextID FROM ApptIDSequence WHERE Name = %s;", self.SEQUENCE)
+                    end = cursor.fetchone()[0]
+                    block = end - size, end
+                    break
+                # first use of the sequence: create its row; if another process won that race,
+                # the insert fails and the UPDATE above is tried again
+                try:
+                    cursor.execute("INSERT INTO ApptIDSequence (Name, NextID) VALUES (%s, %d);",
+                                   (self.SEQUENCE, self.first_id + size))
+                    block = self.first_id, self.first_id + size
+                    break
+                except DatabaseError:
+                    conn.rollback()
+            else:
+                raise DatabaseError("Could not reserve a block of appointment IDs")
+            conn.commit()
+            if conn.grouped:
+                conn.on_group_rollback(lambda: self._drop_block(block[1]))
+            return block
+        finally:
+            cm.close_connection()
+
+    def _drop_block(self, end):
+        # the reservation of the block ending at end was rolled back; stop serving it
+        with self._lock:
+            if self._end == end:
+                self._next = self._end = 0
+
+
+appt_ids = ApptIdAllocator(block_size=int(os.getenv("ApptIdBlock", "100")))
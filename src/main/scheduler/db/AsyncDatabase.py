@@ -0,0 +1,75 @@
+import contextvars
+import functools
+import os
+import threading
+from db.ConnectionManager import ConnectionManager
+
+
+class AsyncDatabase:
+    """
+    asyncio access to the database for the async command handlers.
+
+    Neither pymssql nor sqlite3 has an async API, so each call runs on a small thread pool
+    sized like the connection pool and is awaited from the event loop. Threads are per
+    connection, not per user: any number of sessions can wait on one loop, and independent
+    queries can be issued together with asyncio.gather. Calls run in a copy of the caller's
+    context, so the current session and the instrumented command follow the work.
+
+    The models import this module on every start, but only the async server uses it, so
+    asyncio and the thread pool are loaded on the first call.
+    """
+
+    def __init__(self, workers=10):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler-db")
+        return self._executor
+
+    async def run(self, fn, *args, **kwargs):
+        # run a blocking function (a model method, a handler, a query) off the event loop
+        import asyncio
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+
+    async def fetchall(self, query, params=None, as_dict=True):
+        return await self.run(_fetchall, query, params, as_dict)
+
+    async def execute(self, query, params=None):
+        # a single statement in its own transaction; returns the rowcount
+        return await self.run(_execute, query, params)
+
+
+def _fetchall(query, params, as_dict):
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor(as_dict=as_dict)
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cm.close_connection()
+
+
+def _execute(query, params):
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        rowcount = cursor.rowcount
+        conn.commit()
+        return rowcount
+    finally:
+        cm.close_connection()
+
+
+async_db = AsyncDatabase(workers=int(os.getenv("PoolSize", "10")))
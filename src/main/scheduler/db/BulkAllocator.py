@@ -0,0 +1,56 @@
+import bisect
+import heapq
+
+
+class BulkAllocator:
+    """
+    Pairs a queue of requests with open slots and vaccine doses, in memory.
+
+    Requests are served in the order they are offered. Each one gets the earliest day in
+    its range that still has an open slot, and on that day the caregiver with the fewest
+    appointments so far (existing bookings plus the ones made by this allocator), at that
+    caregiver's earliest open time. A large batch is therefore spread across caregivers
+    instead of filling whichever caregiver sorts first.
+    """
+
+    def __init__(self, slots, doses, loads=None):
+        # slots: {date: [(slot, caregiver), ...]} open slots; doses: {vaccine: available};
+        # loads: {caregiver: booked}
+        self.doses = dict(doses)
+        self.loads = dict(loads or {})
+        self.days = sorted(d for d in slots if slots[d])
+        self._free = {}
+        for d in self.days:
+            heap = [(self.loads.get(caregiver, 0), slot, caregiver) for slot, caregiver in slots[d]]
+            heapq.heapify(heap)
+            self._free[d] = heap
+
+    def assign(self, start, end, vaccine_name):
+        """Take a slot between start and end and a dose of vaccine_name; returns (date, caregiver, slot) or None."""
+        if self.doses.get(vaccine_name, 0) <= 0:
+            return None
+        i = bisect.bisect_left(self.days, start)
+        while i < len(self.days) and self.days[i] <= end:
+            d = self.days[i]
+            taken = self._least_loaded(d)
+            if not self._free[d]:
+                # fully booked days are dropped so later requests do not scan them again
+                del self.days[i]
+            if taken is None:
+                continue
+            slot, caregiver = taken
+            self.doses[vaccine_name] -= 1
+            self.loads[caregiver] = self.loads.get(caregiver, 0) + 1
+            return d, caregiver, slot
+        return None
+
+    def _least_loaded(self, d):
+        heap = self._free[d]
+        while heap:
+            load, slot, caregiver = heapq.heappop(heap)
+            current = self.loads.get(caregiver, 0)
+            if load == current:
+                return slot, caregiver
+            # the caregiver was booked elsewhere since this entry was pushed; re-queue it
+            heapq.heappush(heap, (current, slot, caregiver))
+        return None
@@ -1,30 +1,318 @@
-import pymssql
-import os
-
-
-
-class ConnectionManager:
-
-    def __init__(self):
-        self.server_name =  os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
-        self.conn = None
-
-    def create_connection(self):
-        try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
-        return self.conn
-
-    def close_connection(self):
-        try:
-            self.conn.close()
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+import os
+import threading
+import time
+from db.StorageBackend import DatabaseError, get_backend
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PoolEntry:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checked_out_at = None
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of database connections.
+
+    Connections are handed out LIFO so a small working set stays warm. Idle
+    connections past max_idle and connections older than max_lifetime are
+    closed instead of being reused, and a connection that has sat idle longer
+    than ping_interval is health-checked before it is handed out.
+    """
+
+    def __init__(self, connect, max_size=10, timeout=30.0, max_idle=300.0, max_lifetime=1800.0,
+                 ping_interval=30.0):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Condition()
+        self._idle = []
+        self._in_use = {}
+        self._size = 0
+        self._stats = {
+            "connects": 0,
+            "checkouts": 0,
+            "returns": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "evicted_idle": 0,
+            "evicted_lifetime": 0,
+            "failed_health_checks": 0,
+            "discarded": 0,
+            "checkout_wait_total": 0.0,
+            "checkout_wait_max": 0.0,
+            "hold_total": 0.0,
+            "hold_max": 0.0,
+        }
+
+    def checkout(self):
+        start = time.monotonic()
+        while True:
+            reserved = False
+            with self._lock:
+                stale = self._take_stale()
+                entry = None
+                while not stale:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # reserve the slot before connecting so concurrent callers cannot overshoot max_size
+                        self._size += 1
+                        reserved = True
+                        break
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"No database connection available after {self.timeout}s "
+                                          f"({self.max_size} in use)")
+                    self._stats["waits"] += 1
+                    self._lock.wait(remaining)
+
+            # closing and pinging go over the network, so they happen with the lock released;
+            # meanwhile the entry is neither idle nor in use, but still counts towards the size
+            if stale:
+                for old in stale:
+                    self._discard(old, "evicted_idle")
+                continue
+            if reserved:
+                break
+            now = time.monotonic()
+            if now - entry.created_at > self.max_lifetime:
+                self._discard(entry, "evicted_lifetime")
+                continue
+            if now - entry.last_used > self.ping_interval and not self._ping(entry.conn):
+                self._discard(entry, "failed_health_checks")
+                continue
+            break
+
+        if reserved:
+            try:
+                entry = _PoolEntry(self.connect())
+            except BaseException:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._stats["connects"] += 1
+
+        now = time.monotonic()
+        waited = now - start
+        with self._lock:
+            entry.checked_out_at = now
+            self._in_use[id(entry.conn)] = entry
+            self._stats["checkouts"] += 1
+            self._stats["checkout_wait_total"] += waited
+            self._stats["checkout_wait_max"] = max(self._stats["checkout_wait_max"], waited)
+        return entry.conn
+
+    def release(self, conn):
+        with self._lock:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+
+        now = time.monotonic()
+        healthy = True
+        try:
+            # never hand the next borrower someone else's open transaction
+            conn.rollback()
+        except Exception:
+            healthy = False
+
+        reason = None
+        if not healthy:
+            reason = "discarded"
+        elif now - entry.created_at > self.max_lifetime:
+            reason = "evicted_lifetime"
+        with self._lock:
+            held = now - entry.checked_out_at
+            self._stats["returns"] += 1
+            self._stats["hold_total"] += held
+            self._stats["hold_max"] = max(self._stats["hold_max"], held)
+            if reason is None:
+                entry.last_used = now
+                self._idle.append(entry)
+                self._lock.notify()
+        if reason is not None:
+            self._discard(entry, reason)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._discard(entry)
+        with self._lock:
+            self._lock.notify_all()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = len(self._in_use)
+        checkouts = stats["checkouts"]
+        returns = stats["returns"]
+        stats["checkout_wait_avg"] = stats["checkout_wait_total"] / checkouts if checkouts else 0.0
+        stats["hold_avg"] = stats["hold_total"] / returns if returns else 0.0
+        return stats
+
+    def _take_stale(self):
+        # with self._lock held: remove and return the idle entries unused for longer than max_idle
+        now = time.monotonic()
+        stale = [entry for entry in self._idle if now - entry.last_used > self.max_idle]
+        if stale:
+            self._idle = [entry for entry in self._idle if now - entry.last_used <= self.max_idle]
+        return stale
+
+    def _discard(self, entry, reason=None):
+        # with self._lock released: close the connection, then give its slot back
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            if reason is not None:
+                self._stats[reason] += 1
+            self._lock.notify()
+
+    @staticmethod
+    def _ping(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_backend().connect,
+                    max_size=int(os.getenv("PoolSize", "10")),
+                    timeout=float(os.getenv("PoolTimeout", "30")),
+                    max_idle=float(os.getenv("PoolMaxIdle", "300")),
+                    max_lifetime=float(os.getenv("PoolMaxLifetime", "1800")),
+                    ping_interval=float(os.getenv("PoolPingInterval", "30")),
+                )
+    return _pool
+
+
+_local = threading.local()
+
+
+class SharedConnection:
+    """
+    Makes every ConnectionManager on this thread use one pooled connection until exit.
+
+    Wrap each command in command(). Without transactional, each command still commits on
+    its own, and anything it left uncommitted is rolled back when it ends (as if it had
+    returned its own connection to the pool). With transactional, the group is one database
+    transaction committed on exit: a command's commits only advance a savepoint, and its
+    uncommitted work is rolled back to that savepoint when the command ends.
+    """
+
+    def __init__(self, transactional=False):
+        self.transactional = transactional
+        self.pool = None
+        self.conn = None
+
+    def __enter__(self):
+        self.pool = get_pool()
+        self.conn = self.pool.checkout()
+        try:
+            if self.transactional:
+                self.conn.begin_group()
+        except BaseException:
+            self.pool.release(self.conn)
+            raise
+        _local.shared = self.conn
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.shared = None
+        try:
+            if self.transactional:
+                self.conn.end_group(commit=exc_type is None)
+        finally:
+            self.pool.release(self.conn)
+        return False
+
+    def command(self):
+        return _SharedCommand(self)
+
+
+class _SharedCommand:
+
+    def __init__(self, shared):
+        self.conn = shared.conn
+        self.transactional = shared.transactional
+
+    def __enter__(self):
+        if self.transactional:
+            self.conn.set_savepoint("batch_command")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # discard whatever the command did not commit
+        self.conn.rollback()
+        if self.transactional:
+            self.conn.clear_savepoint()
+        return False
+
+
+class ConnectionManager:
+
+    def __init__(self):
+        self.backend = get_backend()
+        self.pool = get_pool()
+        self.conn = None
+        self.shared = False
+
+    def create_connection(self, shared=True):
+        # shared=False borrows a connection of its own even inside a SharedConnection
+        shared = getattr(_local, "shared", None) if shared else None
+        if shared is not None:
+            self.conn = shared
+            self.shared = True
+            return self.conn
+        try:
+            self.conn = self.pool.checkout()
+        except DatabaseError as db_err:
+            print("Database Programming Error in SQL connection processing! ")
+            print(db_err)
+            quit()
+        return self.conn
+
+    def close_connection(self):
+        # hands the connection back to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn = self.conn
+        self.conn = None
+        if self.shared:
+            # owned by the surrounding SharedConnection
+            self.shared = False
+            return
+        self.pool.release(conn)
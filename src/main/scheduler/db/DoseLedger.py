@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+from db.ConnectionManager import ConnectionManager
+from db.Procedures import OK, INVALID_VACCINE, OUT_OF_STOCK
+
+
+class DoseLedger:
+    """
+    Vaccine stock as partitioned counters plus an append-only ledger.
+
+    Each vaccine's available doses are split over `stripes` rows of DoseCounters, and a
+    booking takes its dose from a random stripe that has one, so concurrent bookings
+    update different rows instead of queueing on one. Every counter change is a relative
+    update (Doses = Doses + n) and appends a DoseLedger row with the same delta in the same
+    transaction, so no change can overwrite another and
+
+        SUM(DoseCounters.Doses) = Vaccines.Doses + SUM(DoseLedger.Delta)
+
+    holds for every vaccine at all times. A booking takes its dose inside the booking's own
+    transaction. compact() folds the ledger into the materialized balance in Vaccines.Doses
+    and spreads each vaccine's doses evenly over its stripes again. It runs in-process after
+    every compact_every bookings, and from cron with python -m db.DoseLedger --compact.
+    """
+
+    def __init__(self, stripes=8, compact_every=1000):
+        self.stripes = stripes
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._bookings = 0
+
+    def take(self, cursor, vaccine_name, reason, apptID=None):
+        """Take one dose in the caller's transaction; returns OK, INVALID_VACCINE or OUT_OF_STOCK."""
+        return self._take(cursor, vaccine_name, reason, apptID)[0]
+
+    def credit(self, cursor, vaccine_name, n, reason, apptID=None):
+        """Add n doses in the caller's transaction: one to a random stripe, more spread over all of them."""
+        if n == 1:
+            cursor.execute("UPDATE DoseCounters SET Doses = Doses + 1 WHERE Name = %s AND Stripe = %d;",
+                           (vaccine_name, random.randrange(self.stripes)))
+            if cursor.rowcount != 1:
+                # stripes are created lazily by compaction; stripe 0 always exists
+                cursor.execute("UPDATE DoseCounters SET Doses = Doses + 1 WHERE Name = %s AND Stripe = 0;",
+                               vaccine_name)
+        else:
+            # one statement: stripe s gets n // stripes, plus one if s < n % stripes (see _split)
+            cursor.execute("UPDATE DoseCounters SET Doses = Doses + %d + CASE WHEN Stripe < %d THEN 1 ELSE 0 END "
+                           "WHERE Name = %s AND Stripe < %d;",
+                           (n // self.stripes, n % self.stripes, vaccine_name, self.stripes))
+            if cursor.rowcount != self.stripes:
+                # some stripes do not exist yet: create them with their share; existing ones are skipped
+                ConnectionManager().backend.insert_new_rows(
+                    cursor, "DoseCounters", ("Name", "Stripe", "Doses"), ("Name", "Stripe"),
+                    [(vaccine_name, stripe, share) for stripe, share in enumerate(_split(n, self.stripes))])
+        self._record(cursor, vaccine_name, n, reason, apptID)
+
+    def debit(self, cursor, vaccine_name, n, reason):
+        """Take n doses in the caller's transaction, from the fullest stripes first; False if there are fewer."""
+        backend = ConnectionManager().backend
+        cursor.execute(f"SELECT Stripe, Doses FROM DoseCounters {backend.lock_hint()} "
+                       f"WHERE Name = %s AND Doses > 0 ORDER BY Doses DESC;", vaccine_name)
+        taken = []
+        left = n
+        for stripe, doses in _tuples(cursor.fetchall()):
+            if left == 0:
+                break
+            taken.append((min(doses, left), vaccine_name, stripe, min(doses, left)))
+            left -= min(doses, left)
+        if left:
+            return False
+        cursor.executemany("UPDATE DoseCounters SET Doses = Doses - %d "
+                           "WHERE Name = %s AND Stripe = %d AND Doses >= %d;", taken)
+        if cursor.rowcount != len(taken):
+            return False
+        self._record(cursor, vaccine_name, -n, reason)
+        return True
+
+    def add_vaccine(self, cursor, vaccine_name):
+        # the counters of a new vaccine, all empty; its doses arrive through credit()
+        ConnectionManager().backend.insert_new_rows(cursor, "DoseCounters", ("Name", "Stripe", "Doses"),
+                                                    ("Name", "Stripe"),
+                                                    [(vaccine_name, stripe, 0) for stripe in range(self.stripes)])
+
+    def compact(self):
+        """
+        Release expired holds, fold the ledger into Vaccines.Doses and rebalance the stripes,
+        in one transaction. Returns the counts of each.
+
+        Bookings no longer hold doses in DoseHolds; holds left there by a version that did
+        are given back here.
+        """
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        backend = cm.backend
+        cursor = conn.cursor()
+        try:
+            conn.begin()
+            cursor.execute(f"SELECT apptID FROM DoseHolds {backend.lock_hint()} WHERE ExpiresAt < %s;",
+                           datetime.datetime.now())
+            released = sum(self._release(cursor, apptID) for apptID, in _tuples(cursor.fetchall()))
+
+            # exactly the entries read are folded and deleted; any committed later wait for the next run
+            cursor.execute(f"SELECT EntryID, Name, Delta FROM DoseLedger {backend.lock_hint()};")
+            entries = _tuples(cursor.fetchall())
+            totals = {}
+            for _, name, delta in entries:
+                totals[name] = totals.get(name, 0) + delta
+            if any(totals.values()):
+                cursor.executemany("UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s;",
+                                   [(delta, name) for name, delta in totals.items() if delta])
+            backend.delete_rows(cursor, "DoseLedger", "EntryID", [entry_id for entry_id, _, _ in entries])
+
+            rebalanced = self._rebalance(cursor, backend)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+        return {"released": released, "folded": len(entries), "rebalanced": rebalanced}
+
+    def maybe_compact(self):
+        # called after each booking; every compact_every-th one in this process compacts
+        with self._lock:
+            self._bookings += 1
+            if self._bookings < self.compact_every:
+                return
+            self._bookings = 0
+        self.compact()
+
+    def check(self):
+        """[(vaccine, counters, balance, ledger), ...] for every vaccine whose counters do not add up."""
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT v.Name, v.Doses, "
+                           "(SELECT COALESCE(SUM(c.Doses), 0) FROM DoseCounters c WHERE c.Name = v.Name), "
+                           "(SELECT COALESCE(SUM(l.Delta), 0) FROM DoseLedger l WHERE l.Name = v.Name) "
+                           "FROM Vaccines v ORDER BY v.Name;")
+            return [(name, counters, balance, ledger) for name, balance, counters, ledger in _tuples(cursor.fetchall())
+                    if counters != balance + ledger]
+        finally:
+            cm.close_connection()
+
+    def _take(self, cursor, vaccine_name, reason, apptID):
+        # (status, stripe the dose came from). A random stripe is tried first, which is enough
+        # while stock is spread over all of them; otherwise the stripes that have doses are read,
+        # and ones emptied since are skipped
+        first = random.randrange(self.stripes)
+        cursor.execute("UPDATE DoseCounters SET Doses = Doses - 1 WHERE Name = %s AND Stripe = %d AND Doses > 0;",
+                       (vaccine_name, first))
+        if cursor.rowcount == 1:
+            self._record(cursor, vaccine_name, -1, reason, apptID)
+            return OK, first
+        cursor.execute("SELECT Stripe FROM DoseCounters WHERE Name = %s AND Doses > 0;", vaccine_name)
+        stripes = [stripe for stripe, in _tuples(cursor.fetchall()) if stripe != first]
+        random.shuffle(stripes)
+        for stripe in stripes:
+            cursor.execute("UPDATE DoseCounters SET Doses = Doses - 1 WHERE Name = %s AND Stripe = %d AND Doses > 0;",
+                           (vaccine_name, stripe))
+            if cursor.rowcount == 1:
+                self._record(cursor, vaccine_name, -1, reason, apptID)
+                return OK, stripe
+        cursor.execute("SELECT COUNT(*) FROM Vaccines WHERE Name = %s;", vaccine_name)
+        if _tuples(cursor.fetchall())[0][0] == 0:
+            return INVALID_VACCINE, None
+        return OUT_OF_STOCK, None
+
+    def _release(self, cursor, apptID):
+        cursor.execute("SELECT Name, Stripe FROM DoseHolds WHERE apptID = %s;", apptID)
+        rows = _tuples(cursor.fetchall())
+        if not rows:
+            return False
+        vaccine_name, stripe = rows[0]
+        # deleting the hold first makes sure it is given back only once
+        cursor.execute("DELETE FROM DoseHolds WHERE apptID = %s;", apptID)
+        if cursor.rowcount != 1:
+            return False
+        cursor.execute("UPDATE DoseCounters SET Doses = Doses + 1 WHERE Name = %s AND Stripe = %d;",
+                       (vaccine_name, stripe))
+        self._record(cursor, vaccine_name, 1, "release", apptID)
+        return True
+
+    def _rebalance(self, cursor, backend):
+        # even out each vaccine's stripes, creating missing ones; totals do not change, so nothing is recorded
+        cursor.execute(f"SELECT Name, Stripe, Doses FROM DoseCounters {backend.lock_hint()} ORDER BY Name, Stripe;")
+        counters = {}
+        for name, stripe, doses in _tuples(cursor.fetchall()):
+            counters.setdefault(name, {})[stripe] = doses
+        new_rows = []
+        updates = []
+        for name, stripes in counters.items():
+            wanted = sorted(set(stripes) | set(range(self.stripes)))
+            shares = _split(sum(stripes.values()), len(wanted))
+            if sorted(shares) == sorted(stripes.get(stripe, 0) for stripe in wanted) and len(stripes) == len(wanted):
+                continue
+            new_rows += [(name, stripe, 0) for stripe in wanted if stripe not in stripes]
+            updates += [(name, stripe, share) for stripe, share in zip(wanted, shares)]
+        if new_rows:
+            backend.insert_new_rows(cursor, "DoseCounters", ("Name", "Stripe", "Doses"), ("Name", "Stripe"), new_rows)
+        if updates:
+            backend.update_rows(cursor, "DoseCounters", ("Name", "Stripe"), ("Doses",), updates)
+        return len({name for name, _, _ in updates})
+
+    def _record(self, cursor, vaccine_name, delta, reason, apptID=None):
+        cursor.execute("INSERT INTO DoseLedger (Name, Delta, Reason, apptID, CreatedAt) VALUES (%s, %d, %s, %s, %s);",
+                       (vaccine_name, delta, reason, apptID, datetime.datetime.now()))
+
+
+def available_query(by_name=False):
+    # Name, Doses for every vaccine (or the one named by the %s parameter): the live stock in its counters
+    where = " WHERE v.Name = %s" if by_name else ""
+    return "SELECT v.Name, COALESCE(SUM(c.Doses), 0) AS Doses FROM Vaccines v " \
+           "LEFT JOIN DoseCounters c ON c.Name = v.Name" + where + " GROUP BY v.Name;"
+
+
+def _split(n, parts):
+    # n as parts near-equal whole shares, largest first
+    return [n // parts + (1 if i < n % parts else 0) for i in range(parts)]
+
+
+def _tuples(rows):
+    # callers pass plain or as_dict cursors; rows as tuples either way
+    return [tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in rows]
+
+
+dose_ledger = DoseLedger(stripes=int(os.getenv("DoseStripes", "8")),
+                         compact_every=int(os.getenv("LedgerCompactEvery", "1000")))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the vaccine dose ledger")
+    parser.add_argument("--compact", action="store_true",
+                        help="release expired holds, fold the ledger into the balances and rebalance the stripes")
+    parser.add_argument("--check", action="store_true", help="verify every vaccine's counters against its ledger")
+    args = parser.parse_args(argv)
+
+    if args.compact:
+        counts = dose_ledger.compact()
+        print(f"Released {counts['released']} expired holds, folded {counts['folded']} ledger entries, "
+              f"rebalanced {counts['rebalanced']} vaccines.")
+    if args.check or not args.compact:
+        mismatches = dose_ledger.check()
+        for name, counters, balance, ledger in mismatches:
+            print(f"{name}: counters {counters} != balance {balance} + ledger {ledger}")
+        if mismatches:
+            return 1
+        print("All dose counters match the ledger.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,264 @@
+import collections
+import contextvars
+import os
+import re
+import threading
+import time
+
+
+class QueryRecord:
+    __slots__ = ("statement", "param_count", "rows", "elapsed", "command", "at")
+
+    def __init__(self, statement, param_count, rows, elapsed, command):
+        self.statement = statement
+        self.param_count = param_count
+        self.rows = rows
+        self.elapsed = elapsed
+        self.command = command
+        self.at = time.time()
+
+    def as_dict(self):
+        return {"statement": self.statement, "params": self.param_count, "rows": self.rows,
+                "elapsed_ms": self.elapsed * 1000, "command": self.command, "at": self.at}
+
+
+class _Totals:
+    __slots__ = ("count", "elapsed", "max_elapsed", "rows")
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.max_elapsed = 0.0
+        self.rows = 0
+
+    def add(self, elapsed, rows):
+        self.count += 1
+        self.elapsed += elapsed
+        self.max_elapsed = max(self.max_elapsed, elapsed)
+        self.rows += max(rows, 0)
+
+
+class _CommandTotals:
+    __slots__ = ("count", "elapsed", "queries", "db_elapsed", "connects", "connect_elapsed", "rows")
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+        self.queries = 0
+        self.db_elapsed = 0.0
+        self.connects = 0
+        self.connect_elapsed = 0.0
+        self.rows = 0
+
+
+_current_command = contextvars.ContextVar("current_command", default=None)
+_thread_counters = threading.local()
+
+
+class Instrumentation:
+    """
+    Records every connect, statement, commit and rollback that goes through the storage
+    backend's wrappers: statement text, number of parameters, rows returned or affected
+    and elapsed time. Parameter values are never kept.
+
+    Work is attributed to the top-level command that is running (see command()), so the
+    per-command totals show how many round trips and how much database time each command
+    costs. Statements slower than slow_threshold seconds are kept in a bounded slow-query
+    log and, if slow_log_path is set, appended to that file.
+    """
+
+    def __init__(self, enabled=True, slow_threshold=0.1, slow_log_size=1000, slow_log_path=None):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.slow_log_path = slow_log_path
+        self.slow_queries = collections.deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+        self._statements = collections.defaultdict(_Totals)
+        self._commands = collections.defaultdict(_CommandTotals)
+        self._connects = _Totals()
+
+    # --- recording -------------------------------------------------------------------
+
+    def command(self, name):
+        """Context manager marking the top-level command that the enclosed database work belongs to."""
+        return _CommandScope(self, name)
+
+    def record_connect(self, elapsed):
+        if not self.enabled:
+            return
+        command = _current_command.get()
+        with self._lock:
+            self._connects.add(elapsed, 0)
+            if command is not None:
+                totals = self._commands[command]
+                totals.connects += 1
+                totals.connect_elapsed += elapsed
+
+    def record_query(self, statement, param_count, rows, elapsed):
+        _thread_counters.round_trips = getattr(_thread_counters, "round_trips", 0) + 1
+        if not self.enabled:
+            return None
+        command = _current_command.get()
+        statement = normalize(statement)
+        record = QueryRecord(statement, param_count, rows, elapsed, command)
+        with self._lock:
+            self._statements[statement].add(elapsed, rows)
+            if command is not None:
+                totals = self._commands[command]
+                totals.queries += 1
+                totals.db_elapsed += elapsed
+                totals.rows += max(rows, 0)
+            if elapsed >= self.slow_threshold:
+                self.slow_queries.append(record)
+                if self.slow_log_path:
+                    self._write_slow(record)
+        return record
+
+    def record_rows(self, record, rows):
+        # rows fetched after the statement ran (SELECT results)
+        if record is None or rows <= 0:
+            return
+        with self._lock:
+            record.rows = max(record.rows, 0) + rows
+            self._statements[record.statement].rows += rows
+            if record.command is not None:
+                self._commands[record.command].rows += rows
+
+    def _finish_command(self, name, elapsed):
+        with self._lock:
+            totals = self._commands[name]
+            totals.count += 1
+            totals.elapsed += elapsed
+
+    def _write_slow(self, record):
+        with open(self.slow_log_path, "a") as f:
+            f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.at))} "
+                    f"{record.elapsed * 1000:.1f}ms command={record.command} params={record.param_count} "
+                    f"rows={record.rows} {record.statement}\n")
+
+    # --- reading ---------------------------------------------------------------------
+
+    @staticmethod
+    def round_trips():
+        """Statements, commits and rollbacks sent by the calling thread so far."""
+        return getattr(_thread_counters, "round_trips", 0)
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._commands.clear()
+            self._connects = _Totals()
+            self.slow_queries.clear()
+
+    def snapshot(self):
+        with self._lock:
+            commands = {
+                name: {
+                    "count": t.count,
+                    "elapsed_ms": t.elapsed * 1000,
+                    "queries": t.queries,
+                    "queries_per_command": t.queries / t.count if t.count else float(t.queries),
+                    "db_ms": t.db_elapsed * 1000,
+                    "connects": t.connects,
+                    "connect_ms": t.connect_elapsed * 1000,
+                    "rows": t.rows,
+                }
+                for name, t in self._commands.items()
+            }
+            statements = {
+                statement: {"count": t.count, "total_ms": t.elapsed * 1000, "max_ms": t.max_elapsed * 1000,
+                            "rows": t.rows}
+                for statement, t in self._statements.items()
+            }
+            connects = {"count": self._connects.count, "total_ms": self._connects.elapsed * 1000,
+                        "max_ms": self._connects.max_elapsed * 1000}
+            slow = [record.as_dict() for record in self.slow_queries]
+        return {"commands": commands, "statements": statements, "connects": connects, "slow_queries": slow}
+
+    def report(self, top=10):
+        snap = self.snapshot()
+        lines = [f"{'command':<28}{'count':>7}{'queries/cmd':>13}{'db ms':>10}{'connects':>10}{'rows':>8}"]
+        for name, c in sorted(snap["commands"].items()):
+            lines.append(f"{name:<28}{c['count']:>7}{c['queries_per_command']:>13.1f}{c['db_ms']:>10.1f}"
+                         f"{c['connects']:>10}{c['rows']:>8}")
+        lines.append("")
+        lines.append(f"connects: {snap['connects']['count']} ({snap['connects']['total_ms']:.1f} ms)")
+        lines.append("")
+        lines.append(f"top {top} statements by total time:")
+        by_time = sorted(snap["statements"].items(), key=lambda item: item[1]["total_ms"], reverse=True)
+        for statement, s in by_time[:top]:
+            lines.append(f"{s['total_ms']:>9.1f} ms {s['count']:>7}x  {statement[:100]}")
+        if snap["slow_queries"]:
+            lines.append("")
+            lines.append(f"slow queries (>= {self.slow_threshold * 1000:.0f} ms):")
+            for record in snap["slow_queries"][-top:]:
+                lines.append(f"{record['elapsed_ms']:>9.1f} ms  [{record['command']}]  {record['statement'][:100]}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = [
+            "# HELP scheduler_db_connects_total Physical database connections opened.",
+            "# TYPE scheduler_db_connects_total counter",
+            f"scheduler_db_connects_total {snap['connects']['count']}",
+            "# HELP scheduler_db_connect_seconds_total Time spent opening database connections.",
+            "# TYPE scheduler_db_connect_seconds_total counter",
+            f"scheduler_db_connect_seconds_total {snap['connects']['total_ms'] / 1000:.6f}",
+        ]
+        metrics = (
+            ("scheduler_commands_total", "Commands run.", "count", 1),
+            ("scheduler_command_seconds_total", "Wall time spent in commands.", "elapsed_ms", 1000),
+            ("scheduler_command_queries_total", "Database round trips made by commands.", "queries", 1),
+            ("scheduler_command_db_seconds_total", "Database time spent by commands.", "db_ms", 1000),
+            ("scheduler_command_rows_total", "Rows returned or affected for commands.", "rows", 1),
+        )
+        for metric, help_text, key, scale in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name, c in sorted(snap["commands"].items()):
+                if scale == 1:
+                    lines.append(f'{metric}{{command="{name}"}} {c[key]}')
+                else:
+                    lines.append(f'{metric}{{command="{name}"}} {c[key] / scale:.6f}')
+        lines.append("# HELP scheduler_slow_queries Statements in the slow-query log.")
+        lines.append("# TYPE scheduler_slow_queries gauge")
+        lines.append(f"scheduler_slow_queries {len(snap['slow_queries'])}")
+        return "\n".join(lines) + "\n"
+
+
+class _CommandScope:
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.token = None
+        self.started = None
+
+    def __enter__(self):
+        # nested scopes keep the outermost command
+        if _current_command.get() is None:
+            self.token = _current_command.set(self.name)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is not None:
+            _current_command.reset(self.token)
+            if self.instrumentation.enabled:
+                self.instrumentation._finish_command(self.name, time.perf_counter() - self.started)
+        return False
+
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize(statement):
+    return _whitespace.sub(" ", statement).strip()
+
+
+instrumentation = Instrumentation(
+    enabled=os.getenv("Instrumentation", "1") != "0",
+    slow_threshold=float(os.getenv("SlowQueryMs", "100")) / 1000,
+    slow_log_path=os.getenv("SlowQueryLog"),
+)
@@ -0,0 +1,166 @@
+import argparse
+import datetime
+import os
+import re
+import sys
+
+
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "migrations")
+
+_migration_file = re.compile(r"^(\d+)_(\w+?)(?:\.(\w+))?\.sql$")
+_batch_separator = re.compile(r"^\s*GO\s*$", re.IGNORECASE | re.MULTILINE)
+_create = re.compile(r"CREATE\s+(?:UNIQUE\s+)?(?:TABLE|INDEX)\s+(\w+)", re.IGNORECASE)
+
+
+class Migrator:
+    """
+    Brings a database's schema up to date by applying numbered migrations in order.
+
+    Migrations are the files in resources/migrations named NNNN_description.sql. A file
+    named NNNN_description.<backend>.sql (e.g. .mssql.sql) replaces the plain one on that
+    backend, for changes the dialects spell differently. Statements are separated by
+    semicolons, or by GO lines in files that define procedures. Each migration runs in one
+    transaction together with its row in SchemaVersion, so it is applied completely or
+    not at all, and a second runner finds it already applied.
+    """
+
+    def __init__(self, backend, path=MIGRATIONS_PATH):
+        self.backend = backend
+        self.path = path
+
+    def migrations(self):
+        # [(version, name, file), ...] in version order, with this backend's files preferred
+        found = {}
+        for filename in os.listdir(self.path):
+            match = _migration_file.match(filename)
+            if match is None:
+                continue
+            version, name, dialect = int(match.group(1)), match.group(2), match.group(3)
+            if dialect is not None and dialect != self.backend.name:
+                continue
+            if dialect is None and version in found:
+                continue
+            found[version] = (version, name, os.path.join(self.path, filename))
+        return [found[version] for version in sorted(found)]
+
+    def latest_version(self):
+        migrations = self.migrations()
+        return migrations[-1][0] if migrations else 0
+
+    def status(self):
+        # [(version, name, applied_at or None), ...]
+        conn = self.backend.connect()
+        try:
+            cursor = conn.cursor()
+            applied = {}
+            if "schemaversion" in {t.lower() for t in self.backend.table_names(cursor)}:
+                cursor.execute("SELECT Version, AppliedAt FROM SchemaVersion;")
+                applied = {version: applied_at for version, applied_at in cursor.fetchall()}
+        finally:
+            conn.close()
+        return [(version, name, applied.get(version)) for version, name, _ in self.migrations()]
+
+    def migrate(self, target=None):
+        """Apply every pending migration up to target (default: all). Returns the (version, name) pairs applied."""
+        applied = []
+        conn = self.backend.connect()
+        try:
+            cursor = conn.cursor()
+            self._create_version_table(conn, cursor)
+            for version, name, path in self.migrations():
+                if target is not None and version > target:
+                    break
+                if self._apply(conn, cursor, version, name, path):
+                    applied.append((version, name))
+        finally:
+            conn.close()
+        return applied
+
+    def _create_version_table(self, conn, cursor):
+        conn.begin()
+        try:
+            tables = {t.lower() for t in self.backend.table_names(cursor)}
+            if "schemaversion" not in tables:
+                baseline = self._baseline_version(cursor, tables)
+                cursor.execute("CREATE TABLE SchemaVersion (Version int, Name varchar(255), AppliedAt datetime, "
+                               "PRIMARY KEY (Version));")
+                for version, name, _ in self.migrations():
+                    if version <= baseline:
+                        self._record(cursor, version, name)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _baseline_version(self, cursor, tables):
+        # a database made from create.sql before migrations were versioned: how far it had got
+        if "caregivers" not in tables:
+            return 0
+        if "slot" in {c.lower() for c in self.backend.column_names(cursor, "Availabilities")}:
+            return 5
+        if "waitlist" in tables:
+            return 4
+        if "apptidsequence" in tables:
+            return 3
+        # 0002 is safe to repeat on any of the earlier layouts
+        return 1
+
+    def _apply(self, conn, cursor, version, name, path):
+        conn.begin()
+        try:
+            # checked inside the transaction, so concurrent runners apply each migration once
+            cursor.execute(f"SELECT MAX(Version) FROM SchemaVersion {self.backend.lock_hint()};")
+            current = cursor.fetchone()[0] or 0
+            if version <= current:
+                conn.commit()
+                return False
+            # tables and indexes a pre-versioning database already has are left as they are
+            existing = {n.lower() for n in self.backend.table_names(cursor) + self.backend.index_names(cursor)}
+            for statement in self.statements(path):
+                match = _create.match(statement)
+                if match and match.group(1).lower() in existing:
+                    continue
+                cursor.execute(statement)
+            self._record(cursor, version, name)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return True
+
+    @staticmethod
+    def _record(cursor, version, name):
+        cursor.execute("INSERT INTO SchemaVersion (Version, Name, AppliedAt) VALUES (%d, %s, %s);",
+                       (version, name, datetime.datetime.now()))
+
+    @staticmethod
+    def statements(path):
+        with open(path) as f:
+            text = re.sub(r"--[^\n]*", "", f.read())
+        if _batch_separator.search(text):
+            # procedure bodies hold several statements, so such files are split into batches on GO lines
+            return [s.strip() for s in _batch_separator.split(text) if s.strip()]
+        return [s.strip() for s in text.split(";") if s.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the scheduler's schema migrations")
+    parser.add_argument("--status", action="store_true", help="list the migrations and when each was applied")
+    parser.add_argument("--target", type=int, metavar="VERSION", help="stop after this version")
+    args = parser.parse_args(argv)
+
+    from db.StorageBackend import create_backend
+    migrator = Migrator(create_backend(os.getenv("Backend", "mssql")))
+    if args.status:
+        for version, name, applied_at in migrator.status():
+            print(f"{version:04d} {name:<24} {applied_at if applied_at is not None else 'pending'}")
+        return
+    applied = migrator.migrate(args.target)
+    for version, name in applied:
+        print(f"Applied {version:04d} {name}")
+    if not applied:
+        print("Schema is up to date.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
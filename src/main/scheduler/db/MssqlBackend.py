@@ -0,0 +1,94 @@
+import os
+import re
+import pymssql
+from db.StorageBackend import StorageBackend
+
+
+class MssqlBackend(StorageBackend):
+    """Azure SQL / SQL Server through pymssql; the scheduler's queries are already in its dialect."""
+
+    name = "mssql"
+    driver_errors = (pymssql.Error,)
+
+    def __init__(self):
+        self.server_name = os.getenv("Server") + ".database.windows.net"
+        self.db_name = os.getenv("DBName")
+        self.user = os.getenv("UserID")
+        self.password = os.getenv("Password")
+
+    def open_raw_connection(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password,
+                               database=self.db_name)
+
+    def raw_cursor(self, raw_conn, as_dict):
+        return raw_conn.cursor(as_dict=as_dict)
+
+    def first_rows(self, query, n):
+        return re.sub(r"^\s*SELECT\s", f"SELECT TOP {int(n)} ", query, count=1, flags=re.IGNORECASE)
+
+    def call_procedure(self, cursor, name, params):
+        # the procedures from migration 0008 return one result set of one row
+        cursor.execute(f"EXEC {name} {', '.join(['%s'] * len(params))};", tuple(params))
+        return cursor.fetchone()
+
+    def table_names(self, cursor):
+        cursor.execute("SELECT name FROM sys.tables;")
+        return [row[0] for row in cursor.fetchall()]
+
+    def index_names(self, cursor):
+        cursor.execute("SELECT name FROM sys.indexes WHERE name IS NOT NULL;")
+        return [row[0] for row in cursor.fetchall()]
+
+    def column_names(self, cursor, table):
+        cursor.execute("SELECT name FROM sys.columns WHERE object_id = OBJECT_ID(%s);", table)
+        return [row[0] for row in cursor.fetchall()]
+
+    def lock_hint(self):
+        return "WITH (UPDLOCK, ROWLOCK)"
+
+    def claim_hint(self):
+        return "WITH (UPDLOCK, READPAST, ROWLOCK)"
+
+    def savepoint(self, cursor, name):
+        cursor.execute(f"SAVE TRANSACTION {name};")
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TRANSACTION {name};")
+
+    def is_transient(self, error):
+        # 1205: chosen as deadlock victim, 1222: lock request timed out
+        cause = error.__cause__
+        return cause is not None and bool(cause.args) and cause.args[0] in (1205, 1222)
+
+    # SQL Server accepts at most 1000 rows in a VALUES list and 2100 parameters per statement
+    def insert_new_rows(self, cursor, table, columns, key_columns, rows):
+        chunk_size = min(1000, 2000 // len(columns))
+        column_list = ", ".join(columns)
+        key_match = " AND ".join(f"t.{k} = v.{k}" for k in key_columns)
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        inserted = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            statement = f"INSERT INTO {table} ({column_list}) " \
+                        f"SELECT {column_list} FROM (VALUES {', '.join([row_placeholder] * len(chunk))}) " \
+                        f"AS v ({column_list}) " \
+                        f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {key_match});"
+            cursor.execute(statement, tuple(value for row in chunk for value in row))
+            inserted += cursor.rowcount
+        return inserted
+
+    def update_rows(self, cursor, table, key_columns, set_columns, rows, null_columns=()):
+        columns = tuple(key_columns) + tuple(set_columns)
+        chunk_size = min(1000, 2000 // len(columns))
+        assignments = ", ".join(f"{c} = v.{c}" for c in set_columns)
+        conditions = [f"t.{k} = v.{k}" for k in key_columns] + [f"t.{c} IS NULL" for c in null_columns]
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        updated = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            statement = f"UPDATE t SET {assignments} FROM {table} t " \
+                        f"JOIN (VALUES {', '.join([row_placeholder] * len(chunk))}) AS v ({', '.join(columns)}) " \
+                        f"ON {' AND '.join(conditions)};"
+            cursor.execute(statement, tuple(value for row in chunk for value in row))
+            updated += cursor.rowcount
+        return updated
@@ -0,0 +1,48 @@
+import os
+from db.ConnectionManager import ConnectionManager
+
+
+# the Status column every procedure returns first
+OK = 0
+INVALID_VACCINE = 1
+OUT_OF_STOCK = 2
+ALREADY_BOOKED = 3
+NO_SLOT = 4
+SLOT_LOST = 5
+NOT_FOUND = 6
+
+
+class Procedures:
+    """
+    Runs the reserve, cancel and upload_availability commands as one procedure call each.
+
+    On SQL Server these are the stored procedures from migration 0008; on SQLite, which has
+    none, the backend runs the same statements in-process (see SqliteProcedures). Either way
+    the command is one round trip inside one transaction: it is committed if the procedure
+    returns status OK and rolled back otherwise.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+    def call(self, name, params):
+        """Call procedure name with params and return its result row (Status first)."""
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            conn.begin()
+            row = cm.backend.call_procedure(cursor, name, params)
+            if row[0] == OK:
+                conn.commit()
+            else:
+                conn.rollback()
+            return row
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+
+procedures = Procedures(enabled=os.getenv("StoredProcedures", "0") == "1")
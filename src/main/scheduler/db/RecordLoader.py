@@ -0,0 +1,50 @@
+from db.ConnectionManager import ConnectionManager
+
+# SQL Server allows 2100 parameters per statement
+MAX_KEYS_PER_QUERY = 1000
+
+
+def load_rows(table, columns, key_column, keys, batch_size=MAX_KEYS_PER_QUERY):
+    """
+    Rows (tuples of columns) of table whose key_column is in keys, one IN (...) query per
+    batch of keys. Keys that are not found are skipped. Only one batch is held at a time,
+    and its pooled connection only while it is fetched.
+    """
+    keys = list(dict.fromkeys(keys))
+    batch_size = min(batch_size, MAX_KEYS_PER_QUERY)
+    select = f"SELECT {', '.join(columns)} FROM {table} WHERE {key_column} IN "
+    for start in range(0, len(keys), batch_size):
+        chunk = tuple(keys[start:start + batch_size])
+        yield from _fetch(select + "(" + ", ".join(["%s"] * len(chunk)) + ");", chunk)
+
+
+def iter_rows(table, columns, key_column, batch_size=1000):
+    """
+    Every row of table in key_column order, batch_size rows per keyset-paginated query
+    (WHERE key > last key seen), so each query is a short index seek however far in it is.
+    """
+    select = f"SELECT {', '.join(columns)} FROM {table}"
+    key_index = list(columns).index(key_column)
+    backend = ConnectionManager().backend
+    after = None
+    while True:
+        if after is None:
+            rows = _fetch(backend.first_rows(f"{select} ORDER BY {key_column}", batch_size), None)
+        else:
+            rows = _fetch(backend.first_rows(f"{select} WHERE {key_column} > %s ORDER BY {key_column}", batch_size),
+                          (after,))
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        after = rows[-1][key_index]
+
+
+def _fetch(query, params):
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        cm.close_connection()
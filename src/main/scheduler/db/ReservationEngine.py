@@ -0,0 +1,149 @@
+import random
+import time
+from db.ConnectionManager import ConnectionManager
+from db.StorageBackend import DatabaseError
+from db.ApptIdAllocator import appt_ids
+from db.Procedures import procedures, OK, INVALID_VACCINE, OUT_OF_STOCK, ALREADY_BOOKED, NO_SLOT
+from db.DoseLedger import dose_ledger
+
+
+class ReservationError(Exception):
+    pass
+
+
+class InvalidVaccine(ReservationError):
+    pass
+
+
+class OutOfStock(ReservationError):
+    pass
+
+
+class AlreadyBooked(ReservationError):
+    pass
+
+
+class NoSlotAvailable(ReservationError):
+    pass
+
+
+class _SlotLost(Exception):
+    # another transaction claimed the slot between our SELECT and UPDATE
+    pass
+
+
+class ReservationEngine:
+    """
+    Books an appointment in a single transaction on a single connection.
+
+    The open slot is claimed with UPDLOCK/READPAST on SQL Server (concurrent
+    bookers skip each other's rows instead of queueing on them) or under the
+    database write lock on SQLite, and the dose is taken from one of the
+    vaccine's stripes (see DoseLedger). Every write is guarded by the state it
+    expects (apptID IS NULL, Doses > 0), so a lost race or a deadlock rolls the
+    whole booking back and it is retried. With StoredProcedures=1 the same
+    transaction is the ReserveAppointment procedure, one round trip per attempt.
+    """
+
+    def __init__(self, max_retries=5, backoff=0.01):
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def reserve(self, username, d, vaccine_name, slot=None):
+        """
+        Book the earliest open slot on d, or the slot starting at slot (minutes after
+        midnight) if it is given. Returns (apptID, caregiver, slot).
+        """
+        attempt = 0
+        while True:
+            try:
+                booked = self._reserve_once(username, d, vaccine_name, slot)
+                break
+            except _SlotLost:
+                pass
+            except DatabaseError as e:
+                if not ConnectionManager().backend.is_transient(e):
+                    raise
+            attempt += 1
+            if attempt > self.max_retries:
+                raise NoSlotAvailable(f"Could not book an appointment on {d} after {attempt} attempts.")
+            time.sleep(self.backoff * (2 ** attempt) * random.random())
+        try:
+            dose_ledger.maybe_compact()
+        except DatabaseError:
+            # the booking is committed; compaction is tried again after a later one
+            pass
+        return booked
+
+    def _reserve_once(self, username, d, vaccine_name, slot):
+        # taken before the transaction starts; a failed attempt just leaves a gap in the IDs
+        apptID = appt_ids.next_id()
+        if procedures.enabled:
+            return self._reserve_procedure(username, d, vaccine_name, slot, apptID)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        backend = cm.backend
+        cursor = conn.cursor(as_dict=True)
+        try:
+            conn.begin()
+
+            # lock the patient row so the same patient cannot book twice concurrently
+            cursor.execute(f"SELECT apptID FROM Patients {backend.lock_hint()} WHERE Username=%s;", username)
+            rows = cursor.fetchall()
+            if rows and rows[0]['apptID'] is not None:
+                raise AlreadyBooked(username)
+
+            if slot is None:
+                claim_slot = backend.first_rows(f"SELECT Username, Slot FROM Availabilities {backend.claim_hint()} "
+                                                f"WHERE Time = %s AND apptID IS NULL ORDER BY Slot, Username", 1)
+                cursor.execute(claim_slot, d)
+            else:
+                claim_slot = backend.first_rows(f"SELECT Username, Slot FROM Availabilities {backend.claim_hint()} "
+                                                f"WHERE Time = %s AND Slot = %d AND apptID IS NULL ORDER BY Username", 1)
+                cursor.execute(claim_slot, (d, slot))
+            rows = cursor.fetchall()
+            if not rows:
+                raise NoSlotAvailable(d)
+            caregiver = rows[0]['Username']
+            slot = rows[0]['Slot']
+
+            cursor.execute("UPDATE Availabilities SET Name=%s, apptID=%s "
+                           "WHERE Time=%s AND Username=%s AND Slot=%d AND apptID IS NULL;",
+                           (vaccine_name, apptID, d, caregiver, slot))
+            if cursor.rowcount != 1:
+                raise _SlotLost()
+
+            cursor.execute("UPDATE Patients SET apptID=%s WHERE Username=%s AND apptID IS NULL;",
+                           (apptID, username))
+            if cursor.rowcount != 1:
+                raise AlreadyBooked(username)
+
+            # the dose is taken last so its stripe's lock is held for the shortest time
+            status = dose_ledger.take(cursor, vaccine_name, "reserve", apptID)
+            if status == INVALID_VACCINE:
+                raise InvalidVaccine(vaccine_name)
+            if status == OUT_OF_STOCK:
+                raise OutOfStock(vaccine_name)
+
+            conn.commit()
+            return apptID, caregiver, slot
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+    def _reserve_procedure(self, username, d, vaccine_name, slot, apptID):
+        status, _, caregiver, slot = procedures.call("ReserveAppointment", (username, d, vaccine_name, slot, apptID))
+        if status == OK:
+            return apptID, caregiver, slot
+        if status == INVALID_VACCINE:
+            raise InvalidVaccine(vaccine_name)
+        if status == OUT_OF_STOCK:
+            raise OutOfStock(vaccine_name)
+        if status == ALREADY_BOOKED:
+            raise AlreadyBooked(username)
+        if status == NO_SLOT:
+            raise NoSlotAvailable(d)
+        raise _SlotLost()
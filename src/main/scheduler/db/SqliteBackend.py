@@ -0,0 +1,119 @@
+import datetime
+import os
+import re
+import sqlite3
+from db.StorageBackend import StorageBackend
+
+
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("date", lambda b: datetime.date.fromisoformat(b.decode()))
+sqlite3.register_converter("datetime", lambda b: datetime.datetime.fromisoformat(b.decode()))
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Embedded single-file engine for local runs, benchmarks and single-node deployments.
+    The database runs in WAL mode so readers never block the writer.
+    """
+
+    name = "sqlite"
+    driver_errors = (sqlite3.Error,)
+    auto_migrate = True
+    locks_database = True
+
+    _placeholder = re.compile(r"%[sd]")
+
+    def __init__(self):
+        self.path = os.getenv("SqliteDB", "scheduler.db")
+
+    def open_raw_connection(self):
+        # the pool hands a connection to one thread at a time, so it may move between threads
+        conn = sqlite3.connect(self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        return conn
+
+    def raw_cursor(self, raw_conn, as_dict):
+        cursor = raw_conn.cursor()
+        if as_dict:
+            cursor.row_factory = _dict_row
+        return cursor
+
+    def format_query(self, query):
+        return self._placeholder.sub("?", query)
+
+    def format_params(self, params):
+        # pymssql accepts a bare value for a single placeholder; sqlite3 always wants a sequence
+        if isinstance(params, (tuple, list, dict)):
+            return params
+        return (params,)
+
+    def first_rows(self, query, n):
+        return f"{query.rstrip().rstrip(';')} LIMIT {int(n)}"
+
+    def insert_new_rows(self, cursor, table, columns, key_columns, rows):
+        # the key columns are the table's primary key, so OR IGNORE skips exactly the duplicates
+        placeholders = ", ".join(["%s"] * len(columns))
+        cursor.executemany(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders});", rows)
+        return cursor.rowcount
+
+    def update_rows(self, cursor, table, key_columns, set_columns, rows, null_columns=()):
+        # UPDATE ... FROM needs SQLite 3.33. A VALUES subquery names its columns column1, column2, ...
+        # (a CTE could name them, but then the sqlite3 module no longer reports rowcount)
+        columns = tuple(key_columns) + tuple(set_columns)
+        v = {c: f"v.column{i + 1}" for i, c in enumerate(columns)}
+        chunk_size = min(1000, 30000 // len(columns))
+        assignments = ", ".join(f"{c} = {v[c]}" for c in set_columns)
+        conditions = [f"{table}.{k} = {v[k]}" for k in key_columns] + [f"{table}.{c} IS NULL" for c in null_columns]
+        row_placeholder = "(" + ", ".join(["%s"] * len(columns)) + ")"
+        updated = 0
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            statement = f"UPDATE {table} SET {assignments} " \
+                        f"FROM (VALUES {', '.join([row_placeholder] * len(chunk))}) AS v " \
+                        f"WHERE {' AND '.join(conditions)};"
+            cursor.execute(statement, tuple(value for row in chunk for value in row))
+            updated += cursor.rowcount
+        return updated
+
+    def call_procedure(self, cursor, name, params):
+        # no stored procedures in SQLite: the same statements run in-process, on this transaction
+        from db.SqliteProcedures import PROCEDURES
+        return PROCEDURES[name](cursor, *params)
+
+    def table_names(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        return [row[0] for row in cursor.fetchall()]
+
+    def index_names(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='index';")
+        return [row[0] for row in cursor.fetchall()]
+
+    def column_names(self, cursor, table):
+        cursor.execute(f"PRAGMA table_info({table});")
+        return [row[1] for row in cursor.fetchall()]
+
+    def begin(self, cursor):
+        # take the write lock up front: SQLite locks the whole database, which serialises
+        # slot claims the same way UPDLOCK does row by row on SQL Server
+        cursor.execute("BEGIN IMMEDIATE;")
+
+    def savepoint(self, cursor, name):
+        cursor.execute(f"SAVEPOINT {name};")
+
+    def release_savepoint(self, cursor, name):
+        cursor.execute(f"RELEASE SAVEPOINT {name};")
+
+    def rollback_to_savepoint(self, cursor, name):
+        cursor.execute(f"ROLLBACK TO SAVEPOINT {name};")
+
+    def is_transient(self, error):
+        cause = error.__cause__
+        return isinstance(cause, sqlite3.OperationalError) and ("locked" in str(cause) or "busy" in str(cause))
@@ -0,0 +1,74 @@
+from db.Procedures import OK, ALREADY_BOOKED, NO_SLOT, SLOT_LOST, NOT_FOUND
+from db.DoseLedger import dose_ledger
+
+# SQLite has no stored procedures. These run the statements of the procedures in
+# migrations/0008_procedures.mssql.sql (as redefined by 0009), in the same order, on the
+# caller's cursor and transaction; with the database in-process there is no round trip to
+# save between them.
+
+
+def reserve_appointment(cursor, patient, d, vaccine_name, slot, apptID):
+    status = dose_ledger.take(cursor, vaccine_name, "reserve", apptID)
+    if status != OK:
+        return status, None, None, None
+
+    cursor.execute("SELECT apptID FROM Patients WHERE Username = %s;", patient)
+    row = cursor.fetchone()
+    if row is not None and row[0] is not None:
+        return ALREADY_BOOKED, None, None, None
+
+    if slot is None:
+        cursor.execute("SELECT Username, Slot FROM Availabilities WHERE Time = %s AND apptID IS NULL "
+                       "ORDER BY Slot, Username LIMIT 1;", d)
+    else:
+        cursor.execute("SELECT Username, Slot FROM Availabilities WHERE Time = %s AND Slot = %d AND apptID IS NULL "
+                       "ORDER BY Username LIMIT 1;", (d, slot))
+    row = cursor.fetchone()
+    if row is None:
+        return NO_SLOT, None, None, None
+    caregiver, slot = row
+
+    cursor.execute("UPDATE Availabilities SET Name = %s, apptID = %s "
+                   "WHERE Time = %s AND Username = %s AND Slot = %d AND apptID IS NULL;",
+                   (vaccine_name, apptID, d, caregiver, slot))
+    if cursor.rowcount != 1:
+        return SLOT_LOST, None, None, None
+    cursor.execute("UPDATE Patients SET apptID = %s WHERE Username = %s AND apptID IS NULL;", (apptID, patient))
+    if cursor.rowcount != 1:
+        return ALREADY_BOOKED, None, None, None
+    return OK, apptID, caregiver, slot
+
+
+def cancel_appointment(cursor, apptID, user, cancelled_by, cancelled_at):
+    cursor.execute("SELECT a.Name, a.Time, a.Slot, a.Username, p.Username FROM Availabilities a "
+                   "JOIN Patients p ON a.apptID = p.apptID WHERE a.apptID = %s;", apptID)
+    row = cursor.fetchone()
+    if row is None:
+        return NOT_FOUND, None
+    vaccine_name, d, slot, caregiver, patient = row
+    if user != (patient if cancelled_by == "patient" else caregiver):
+        return NOT_FOUND, None
+
+    if cancelled_by == "patient":
+        cursor.execute("UPDATE Availabilities SET apptID = NULL, Name = NULL WHERE apptID = %s;", apptID)
+    else:
+        cursor.execute("DELETE FROM Availabilities WHERE apptID = %s;", apptID)
+    cursor.execute("UPDATE Patients SET apptID = NULL WHERE Username = %s;", patient)
+    cursor.execute("INSERT INTO Cancellations (apptID, Time, Slot, Caregiver, Patient, Name, CancelledBy, "
+                   "CancelledAt) VALUES (%s, %s, %d, %s, %s, %s, %s, %s);",
+                   (apptID, d, slot, caregiver, patient, vaccine_name, cancelled_by, cancelled_at))
+    dose_ledger.credit(cursor, vaccine_name, 1, "cancel", apptID)
+    return OK, vaccine_name
+
+
+def upload_availability(cursor, caregiver, d, slots):
+    rows = [(d, caregiver, slot) for slot in sorted({int(s) for s in slots.split(",")})]
+    cursor.executemany("INSERT OR IGNORE INTO Availabilities (Time, Username, Slot) VALUES (%s, %s, %d);", rows)
+    return OK, cursor.rowcount
+
+
+PROCEDURES = {
+    "ReserveAppointment": reserve_appointment,
+    "CancelAppointment": cancel_appointment,
+    "UploadAvailability": upload_availability,
+}
@@ -0,0 +1,325 @@
+import os
+import threading
+import time
+from db.Instrumentation import instrumentation
+
+
+class DatabaseError(Exception):
+    """
+    Raised for any driver error, whichever backend is in use.
+    The original driver exception is kept as __cause__.
+    """
+    pass
+
+
+class StorageBackend:
+    """
+    Base class for the storage engines the scheduler can run against.
+
+    Queries throughout the code base are written once, pymssql style (%s / %d
+    placeholders); a backend translates them for its driver, opens raw
+    connections, and supplies the few pieces of SQL that differ between dialects.
+    """
+
+    name = None
+    # driver exception class(es) that get re-raised as DatabaseError
+    driver_errors = ()
+    # apply pending migrations (see Migrator) the first time the backend is used
+    auto_migrate = False
+    # a write transaction locks the whole database, not just the rows it touches
+    locks_database = False
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            conn = Connection(self, self.open_raw_connection())
+        except self.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+        instrumentation.record_connect(time.perf_counter() - started)
+        return conn
+
+    def open_raw_connection(self):
+        raise NotImplementedError
+
+    def raw_cursor(self, raw_conn, as_dict):
+        raise NotImplementedError
+
+    def format_query(self, query):
+        return query
+
+    def format_params(self, params):
+        return params
+
+    def first_rows(self, query, n):
+        """Limit a "SELECT ..." statement (no trailing semicolon) to its first n rows."""
+        raise NotImplementedError
+
+    def table_names(self, cursor):
+        raise NotImplementedError
+
+    def insert_new_rows(self, cursor, table, columns, key_columns, rows):
+        """
+        Insert rows whose key is not already in the table, in as few statements as the
+        driver allows; rows already in the table are skipped by the database. rows must not
+        repeat a key among themselves. Returns the number inserted.
+        """
+        raise NotImplementedError
+
+    def update_rows(self, cursor, table, key_columns, set_columns, rows, null_columns=()):
+        """
+        Set set_columns on the rows matching each key, joined against a VALUES list so a
+        whole batch is one statement per chunk. Each row holds the key values followed by
+        the new values. Only rows whose null_columns are still NULL are updated. Returns
+        the number of rows updated.
+        """
+        raise NotImplementedError
+
+    def delete_rows(self, cursor, table, key_column, keys):
+        # one DELETE ... IN (...) per chunk of keys; returns the number of rows deleted
+        deleted = 0
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            cursor.execute(f"DELETE FROM {table} WHERE {key_column} IN ({', '.join(['%s'] * len(chunk))});",
+                           tuple(chunk))
+            deleted += cursor.rowcount
+        return deleted
+
+    def call_procedure(self, cursor, name, params):
+        """Run one of the procedures in Procedures on cursor's transaction; returns its result row."""
+        raise NotImplementedError
+
+    def begin(self, cursor):
+        """Start a write transaction; drivers that open one implicitly need nothing here."""
+        pass
+
+    def savepoint(self, cursor, name):
+        raise NotImplementedError
+
+    def release_savepoint(self, cursor, name):
+        pass
+
+    def rollback_to_savepoint(self, cursor, name):
+        raise NotImplementedError
+
+    def lock_hint(self):
+        """Table hint that locks the rows a SELECT reads until the transaction ends."""
+        return ""
+
+    def claim_hint(self):
+        """Like lock_hint, but rows already locked by another transaction are skipped."""
+        return ""
+
+    def is_transient(self, error):
+        """True if a DatabaseError is a deadlock or lock timeout worth retrying."""
+        return False
+
+    def index_names(self, cursor):
+        raise NotImplementedError
+
+    def column_names(self, cursor, table):
+        raise NotImplementedError
+
+
+class Connection:
+    """
+    Thin wrapper giving every driver the pymssql connection interface used by the scheduler.
+
+    While grouped (see ConnectionManager.SharedConnection) the connection runs inside one
+    long transaction: commit() only moves a savepoint forward and rollback() returns to it,
+    so each command keeps its own all-or-nothing behaviour inside the group.
+    """
+
+    def __init__(self, backend, raw):
+        self.backend = backend
+        self.raw = raw
+        self.grouped = False
+        self.savepoint = None
+        self._undo = []
+
+    def cursor(self, as_dict=False):
+        return Cursor(self.backend, self.backend.raw_cursor(self.raw, as_dict))
+
+    def begin(self):
+        if not self.grouped:
+            self.backend.begin(self.cursor())
+
+    def begin_group(self):
+        self.backend.begin(self.cursor())
+        self.grouped = True
+
+    def end_group(self, commit=True):
+        self.grouped = False
+        self.savepoint = None
+        undo, self._undo = self._undo, []
+        try:
+            if commit:
+                self.commit()
+                undo = []
+            else:
+                self.rollback()
+        finally:
+            for callback in undo:
+                callback()
+
+    def on_group_rollback(self, callback):
+        # call callback() if the group this connection is in does not commit
+        self._undo.append(callback)
+
+    def set_savepoint(self, name):
+        self.backend.savepoint(self.cursor(), name)
+        self.savepoint = name
+
+    def clear_savepoint(self):
+        if self.savepoint is not None:
+            self.backend.release_savepoint(self.cursor(), self.savepoint)
+            self.savepoint = None
+
+    def commit(self):
+        if self.savepoint is not None:
+            cursor = self.cursor()
+            self.backend.release_savepoint(cursor, self.savepoint)
+            self.backend.savepoint(cursor, self.savepoint)
+            return
+        started = time.perf_counter()
+        try:
+            self.raw.commit()
+        except self.backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+        finally:
+            instrumentation.record_query("COMMIT", 0, -1, time.perf_counter() - started)
+
+    def rollback(self):
+        if self.savepoint is not None:
+            self.backend.rollback_to_savepoint(self.cursor(), self.savepoint)
+            return
+        started = time.perf_counter()
+        try:
+            self.raw.rollback()
+        except self.backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+        finally:
+            instrumentation.record_query("ROLLBACK", 0, -1, time.perf_counter() - started)
+
+    def close(self):
+        try:
+            self.raw.close()
+        except self.backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+
+
+class Cursor:
+    """Driver cursor wrapper: translates queries and records each round trip with the instrumentation."""
+
+    def __init__(self, backend, raw):
+        self.backend = backend
+        self.raw = raw
+        self.record = None
+
+    def execute(self, query, params=None):
+        query = self.backend.format_query(query)
+        started = time.perf_counter()
+        try:
+            if params is None:
+                self.raw.execute(query)
+            else:
+                params = self.backend.format_params(params)
+                self.raw.execute(query, params)
+        except self.backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+        finally:
+            self.record = instrumentation.record_query(query, _param_count(params), self._rowcount(),
+                                                       time.perf_counter() - started)
+        return self
+
+    def executemany(self, query, seq_of_params):
+        query = self.backend.format_query(query)
+        seq_of_params = [self.backend.format_params(p) for p in seq_of_params]
+        started = time.perf_counter()
+        try:
+            self.raw.executemany(query, seq_of_params)
+        except self.backend.driver_errors as e:
+            raise DatabaseError(str(e)) from e
+        finally:
+            self.record = instrumentation.record_query(query, sum(_param_count(p) for p in seq_of_params),
+                                                       self._rowcount(), time.perf_counter() - started)
+        return self
+
+    def fetchone(self):
+        row = self.raw.fetchone()
+        if row is not None:
+            instrumentation.record_rows(self.record, 1)
+        return row
+
+    def fetchmany(self, size):
+        rows = self.raw.fetchmany(size)
+        instrumentation.record_rows(self.record, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.raw.fetchall()
+        instrumentation.record_rows(self.record, len(rows))
+        return rows
+
+    def _rowcount(self):
+        try:
+            return self.raw.rowcount
+        except Exception:
+            return -1
+
+    @property
+    def rowcount(self):
+        return self.raw.rowcount
+
+    @property
+    def description(self):
+        return self.raw.description
+
+    def __iter__(self):
+        for row in self.raw:
+            instrumentation.record_rows(self.record, 1)
+            yield row
+
+    def stream(self, buffer_size=100):
+        # rows through a fixed-size fetchmany buffer, so a large result is never held in memory at once
+        while True:
+            rows = self.fetchmany(buffer_size)
+            if not rows:
+                return
+            yield from rows
+
+
+def _param_count(params):
+    if params is None:
+        return 0
+    if isinstance(params, (tuple, list, dict)):
+        return len(params)
+    return 1
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name):
+    name = name.lower()
+    if name == "mssql":
+        from db.MssqlBackend import MssqlBackend
+        return MssqlBackend()
+    if name == "sqlite":
+        from db.SqliteBackend import SqliteBackend
+        return SqliteBackend()
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def get_backend():
+    # selected once per process with the Backend environment variable (mssql by default)
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = create_backend(os.getenv("Backend", "mssql"))
+                if backend.auto_migrate or os.getenv("ApplySchema"):
+                    from db.Migrator import Migrator
+                    Migrator(backend).migrate()
+                _backend = backend
+    return _backend
@@ -0,0 +1,169 @@
+import datetime
+import random
+import time
+from db.ConnectionManager import ConnectionManager
+from db.StorageBackend import DatabaseError
+from db.ApptIdAllocator import appt_ids
+from db.BulkAllocator import BulkAllocator
+from db.DoseLedger import dose_ledger
+
+
+class _MatchLost(Exception):
+    # a slot or dose we planned to hand out was taken before our guarded UPDATE
+    pass
+
+
+class WaitlistMatcher:
+    """
+    Assigns open slots and available doses to waitlisted patients, first come first
+    served (by JoinedAt).
+
+    One run is one transaction: it reads the waitlist, the doses and the open slots in
+    the waitlist's date range, pairs them up in memory with a BulkAllocator, and writes
+    every assignment back with a few set-based statements. Writes are guarded like
+    ReservationEngine's, so if anything moved underneath us the run is rolled back and
+    retried.
+    """
+
+    def __init__(self, max_retries=5, backoff=0.01):
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def match(self, vaccine_name=None, limit=1):
+        """
+        Make at most limit assignments (None: as many as possible), for vaccine_name only
+        if it is given. Returns a list of (username, apptID, caregiver, date, slot, vaccine_name).
+        """
+        # most capacity changes happen with nobody waiting; find that out without a write transaction
+        waiting = self.waiting(vaccine_name)
+        limit = waiting if limit is None else min(limit, waiting)
+        if limit <= 0:
+            return []
+        attempt = 0
+        while True:
+            try:
+                return self._match_once(vaccine_name, limit)
+            except _MatchLost:
+                pass
+            except DatabaseError as e:
+                if not ConnectionManager().backend.is_transient(e):
+                    raise
+            attempt += 1
+            if attempt > self.max_retries:
+                return []
+            time.sleep(self.backoff * (2 ** attempt) * random.random())
+
+    @staticmethod
+    def waiting(vaccine_name=None):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            if vaccine_name is None:
+                cursor.execute("SELECT COUNT(*) FROM Waitlist;")
+            else:
+                cursor.execute("SELECT COUNT(*) FROM Waitlist WHERE Name = %s;", vaccine_name)
+            return cursor.fetchone()[0]
+        finally:
+            cm.close_connection()
+
+    def _match_once(self, vaccine_name, limit):
+        # IDs are taken before the transaction starts (see ApptIdAllocator); unused ones become gaps
+        ids = appt_ids.next_ids(limit)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        backend = cm.backend
+        cursor = conn.cursor(as_dict=True)
+        try:
+            conn.begin()
+
+            # read without locks; the doses are taken from the counters, guarded, once matches are made
+            if vaccine_name is None:
+                cursor.execute("SELECT Name, SUM(Doses) AS Doses FROM DoseCounters GROUP BY Name "
+                               "HAVING SUM(Doses) > 0;")
+            else:
+                cursor.execute("SELECT Name, SUM(Doses) AS Doses FROM DoseCounters WHERE Name = %s GROUP BY Name "
+                               "HAVING SUM(Doses) > 0;", vaccine_name)
+            doses = {row['Name']: row['Doses'] for row in cursor.fetchall()}
+            if not doses:
+                conn.commit()
+                return []
+
+            get_waitlist = f"SELECT w.Username, w.StartDate, w.EndDate, w.Name, p.apptID " \
+                           f"FROM Waitlist w {backend.lock_hint()} JOIN Patients p ON p.Username = w.Username"
+            if vaccine_name is None:
+                cursor.execute(get_waitlist + " ORDER BY w.JoinedAt, w.Username;")
+            else:
+                cursor.execute(get_waitlist + " WHERE w.Name = %s ORDER BY w.JoinedAt, w.Username;", vaccine_name)
+            entries = cursor.fetchall()
+            # patients who booked through reserve since joining are just removed
+            stale = [e['Username'] for e in entries if e['apptID'] is not None]
+            entries = [e for e in entries if e['apptID'] is None and doses.get(e['Name'], 0) > 0]
+
+            matches = []
+            if entries:
+                start = min(e['StartDate'] for e in entries)
+                end = max(e['EndDate'] for e in entries)
+                allocator = BulkAllocator(self._open_slots(cursor, backend, start, end), doses,
+                                          self._loads(cursor, start, end))
+                for e in entries:
+                    if len(matches) == limit:
+                        break
+                    booked = allocator.assign(e['StartDate'], e['EndDate'], e['Name'])
+                    if booked is not None:
+                        d, caregiver, slot = booked
+                        matches.append((e['Username'], ids[len(matches)], caregiver, d, slot, e['Name']))
+
+            if matches:
+                updated = backend.update_rows(cursor, "Availabilities", ("Time", "Username", "Slot"),
+                                              ("Name", "apptID"),
+                                              [(d, caregiver, slot, name, apptID)
+                                               for _, apptID, caregiver, d, slot, name in matches],
+                                              null_columns=("apptID",))
+                if updated != len(matches):
+                    raise _MatchLost()
+                updated = backend.update_rows(cursor, "Patients", ("Username",), ("apptID",),
+                                              [(username, apptID) for username, apptID, _, _, _, _ in matches],
+                                              null_columns=("apptID",))
+                if updated != len(matches):
+                    raise _MatchLost()
+                used = {}
+                for _, _, _, _, _, name in matches:
+                    used[name] = used.get(name, 0) + 1
+                for name, n in used.items():
+                    if not dose_ledger.debit(cursor, name, n, "waitlist"):
+                        raise _MatchLost()
+            done = stale + [username for username, _, _, _, _, _ in matches]
+            if done:
+                backend.delete_rows(cursor, "Waitlist", "Username", done)
+
+            conn.commit()
+            return matches
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+    @staticmethod
+    def _open_slots(cursor, backend, start, end):
+        # {date: [(slot, caregiver), ...]} for unbooked slots between start and end, skipping rows other bookers hold
+        start = max(start, datetime.date.today())
+        slots = {}
+        if end < start:
+            return slots
+        cursor.execute(f"SELECT Time, Slot, Username FROM Availabilities {backend.claim_hint()} "
+                       f"WHERE Time >= %s AND Time <= %s AND apptID IS NULL ORDER BY Time, Slot, Username;",
+                       (start, end))
+        for row in cursor:
+            slots.setdefault(row['Time'], []).append((row['Slot'], row['Username']))
+        return slots
+
+    @staticmethod
+    def _loads(cursor, start, end):
+        # {caregiver: appointments already booked between start and end}, used to balance new ones
+        cursor.execute("SELECT Username, COUNT(*) AS Booked FROM Availabilities "
+                       "WHERE Time >= %s AND Time <= %s AND apptID IS NOT NULL GROUP BY Username;",
+                       (start, end))
+        return {row['Username']: row['Booked'] for row in cursor.fetchall()}
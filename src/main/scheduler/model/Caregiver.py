@@ -1,91 +1,147 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-
-class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
-        self.username = username
-        self.password = password
-        self.salt = salt
-        self.hash = hash
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_username(self):
-        return self.username
-
-    def get_salt(self):
-        return self.salt
-
-    def get_hash(self):
-        return self.hash
-
-    def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s);"
-        try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
-
-    # Insert availability with parameter date d
-    def upload_availability(self, d):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        # VALUES: Time, Username, ApptID, Name
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s, NULL, NULL);"
-        appt_exists = "SELECT COUNT(*) AS total FROM Availabilities WHERE Username=%s AND Time=%s;"
-        try:
-            cursor.execute(appt_exists, (self.username, d))
-            total = 0
-            for row in cursor:
-                total = row['total']
-            if total != 0:
-                raise Exception("This time slot has already been uploaded, try again.")
-            cursor.execute(add_availability, (d, self.username))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating caregiver availability")
-            raise
-        finally:
-            cm.close_connection()
+import os
+from util.Util import Util
+from db.ConnectionManager import ConnectionManager
+from db.AsyncDatabase import async_db
+from db.StorageBackend import DatabaseError
+from db.RecordLoader import iter_rows, load_rows
+from db.Procedures import procedures
+from model.CredentialCache import credential_cache
+
+
+# a slot is a start time in minutes after midnight; uploads without times offer this one slot per day
+DAY_SLOT = 9 * 60
+# length of the slots a time window is cut into
+SLOT_MINUTES = int(os.getenv("SlotMinutes", "15"))
+
+
+class Caregiver:
+    # no per-instance __dict__, so the bulk loaders below can hold many caregivers cheaply
+    __slots__ = ("username", "password", "salt", "hash")
+
+    def __init__(self, username, password=None, salt=None, hash=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+
+    # getters
+    def get(self):
+        # served from the credential cache when it can be; see CredentialCache
+        credentials = credential_cache.lookup("Caregivers", self.username)
+        if credentials is None:
+            Util.verify_dummy(self.password)
+            return None
+        curr_salt, curr_hash = credentials
+        if not Util.verify_hash(self.password, curr_salt, curr_hash):
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = curr_hash
+        if Util.needs_rehash(curr_hash):
+            try:
+                self.rehash()
+            except DatabaseError:
+                # the old hash still works; the upgrade is retried on the next login
+                pass
+        return self
+
+    # re-hash a verified password with the configured algorithm and work factor
+    def rehash(self):
+        salt = Util.generate_salt()
+        hash = Util.generate_hash(self.password, salt)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        update_hash = "UPDATE Caregivers SET Salt = %s, Hash = %s WHERE Username = %s"
+        try:
+            cursor.execute(update_hash, (salt, hash, self.username))
+            conn.commit()
+        finally:
+            cm.close_connection()
+        self.salt = salt
+        self.hash = hash
+        credential_cache.store("Caregivers", self.username, salt, hash)
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s);"
+        try:
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        # also forgets that the name was unknown, so the new user can log in right away
+        credential_cache.store("Caregivers", self.username, self.salt, self.hash)
+
+    # Insert availability with parameter date d
+    def upload_availability(self, d, slots=None):
+        if procedures.enabled:
+            slot_list = ",".join(str(slot) for slot in sorted(set(slots))) if slots else str(DAY_SLOT)
+            _, inserted = procedures.call("UploadAvailability", (self.username, d, slot_list))
+        else:
+            inserted, skipped = self.upload_availabilities([d], slots)
+        if inserted == 0:
+            raise Exception("This time slot has already been uploaded, try again.")
+
+    # Insert a slot at each time in slots (minutes after midnight; default DAY_SLOT) on every
+    # date in dates; slots already uploaded are skipped. Returns (inserted, skipped)
+    def upload_availabilities(self, dates, slots=None):
+        slots = sorted(set(slots)) if slots else [DAY_SLOT]
+        rows = [(d, self.username, slot) for d in sorted(set(dates)) for slot in slots]
+        if not rows:
+            return 0, 0
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            inserted = cm.backend.insert_new_rows(cursor, "Availabilities", ("Time", "Username", "Slot"),
+                                                  ("Time", "Username", "Slot"), rows)
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DatabaseError:
+            # print("Error occurred when updating caregiver availability")
+            raise
+        finally:
+            cm.close_connection()
+        return inserted, len(rows) - inserted
+
+    # bulk loaders for admin tooling: caregivers with their stored credentials (no password),
+    # fetched a batch at a time and yielded one by one
+    @classmethod
+    def load_many(cls, usernames, batch_size=1000):
+        for username, salt, hash in load_rows("Caregivers", ("Username", "Salt", "Hash"), "Username", usernames,
+                                              batch_size):
+            yield cls(username, salt=salt, hash=hash)
+
+    @classmethod
+    def iter_all(cls, batch_size=1000):
+        for username, salt, hash in iter_rows("Caregivers", ("Username", "Salt", "Hash"), "Username", batch_size):
+            yield cls(username, salt=salt, hash=hash)
+
+    # async versions, for handlers running on an event loop; the work itself runs on async_db's threads
+    async def get_async(self):
+        return await async_db.run(self.get)
+
+    async def save_to_db_async(self):
+        return await async_db.run(self.save_to_db)
+
+    async def upload_availabilities_async(self, dates, slots=None):
+        return await async_db.run(self.upload_availabilities, dates, slots)
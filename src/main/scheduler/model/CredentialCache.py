@@ -0,0 +1,103 @@
+import collections
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+
+
+class CredentialCache:
+    """
+    In-process read-through cache of login credentials: (table, username) -> (salt, hash).
+
+    Users that exist are kept for ttl seconds in an LRU of at most max_size entries.
+    Usernames that do not exist are remembered for negative_ttl seconds in a separate LRU
+    of the same size, so a storm of logins or existence checks for unknown names is
+    answered locally. Because that LRU is bounded and short-lived, it cannot be used to
+    grow memory without limit, and a user created by another process is visible after
+    negative_ttl at most. save_to_db and rehash in this process update the cache directly.
+    """
+
+    def __init__(self, ttl=300.0, negative_ttl=5.0, max_size=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._found = collections.OrderedDict()
+        self._missing = collections.OrderedDict()
+
+    def lookup(self, table, username):
+        # (salt, hash), or None if there is no such user
+        key = (table, username)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._found.get(key)
+            if entry is not None and entry[1] > now:
+                self._found.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            expires = self._missing.get(key)
+            if expires is not None and expires > now:
+                self.negative_hits += 1
+                return None
+            self.misses += 1
+
+        credentials = self._load(table, username)
+        with self._lock:
+            if credentials is None:
+                self._put(self._missing, key, now + self.negative_ttl)
+            else:
+                self._missing.pop(key, None)
+                self._put(self._found, key, (credentials, now + self.ttl))
+        return credentials
+
+    def exists(self, table, username):
+        return self.lookup(table, username) is not None
+
+    def store(self, table, username, salt, hash):
+        # the user's credentials were just written by this process
+        key = (table, username)
+        with self._lock:
+            self._missing.pop(key, None)
+            self._put(self._found, key, ((salt, hash), time.monotonic() + self.ttl))
+
+    def invalidate(self, table=None, username=None):
+        with self._lock:
+            if username is None:
+                self._found.clear()
+                self._missing.clear()
+            else:
+                self._found.pop((table, username), None)
+                self._missing.pop((table, username), None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses,
+                    "size": len(self._found), "negative_size": len(self._missing)}
+
+    def _put(self, entries, key, value):
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    @staticmethod
+    def _load(table, username):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+        try:
+            cursor.execute(f"SELECT Salt, Hash FROM {table} WHERE Username = %s", username)
+            rows = cursor.fetchall()
+        finally:
+            cm.close_connection()
+        if not rows:
+            return None
+        return rows[0]['Salt'], rows[0]['Hash']
+
+
+credential_cache = CredentialCache(ttl=float(os.getenv("CredentialCacheTTL", "300")),
+                                   negative_ttl=float(os.getenv("NegativeCacheTTL", "5")),
+                                   max_size=int(os.getenv("CredentialCacheSize", "10000")))
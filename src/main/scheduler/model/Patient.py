@@ -1,71 +1,112 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
-from util.Util import Util
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-class Patient:
-    def __init__(self, username, password=None, salt=None, hash=None):
-        self.username = username
-        self.password = password
-        self.salt = salt
-        self.hash = hash
-        self.apptID = None
-
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
-        try:
-            cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
-            raise e
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_apptID(self):
-        return self.apptID
-
-    def get_username(self):
-        return self.username
-
-    def get_salt(self):
-        return self.salt
-
-    def get_hash(self):
-        return self.hash
-
-    def save_to_db(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-        # VALUES: Username, salt, hash,  apptID
-        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s, NULL)"
-        try:
-            cursor.execute(add_patients, (self.username, self.salt, self.hash))
-            # TODO you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            raise
-        finally:
-            cm.close_connection()
-
+from util.Util import Util
+from db.ConnectionManager import ConnectionManager
+from db.AsyncDatabase import async_db
+from db.StorageBackend import DatabaseError
+from db.RecordLoader import iter_rows, load_rows
+from model.CredentialCache import credential_cache
+
+class Patient:
+    # no per-instance __dict__, so the bulk loaders below can hold many patients cheaply
+    __slots__ = ("username", "password", "salt", "hash", "apptID")
+
+    def __init__(self, username, password=None, salt=None, hash=None):
+        self.username = username
+        self.password = password
+        self.salt = salt
+        self.hash = hash
+        self.apptID = None
+
+
+    # getters
+    def get(self):
+        # served from the credential cache when it can be; see CredentialCache
+        credentials = credential_cache.lookup("Patients", self.username)
+        if credentials is None:
+            Util.verify_dummy(self.password)
+            return None
+        curr_salt, curr_hash = credentials
+        if not Util.verify_hash(self.password, curr_salt, curr_hash):
+            # print("Incorrect password")
+            return None
+        self.salt = curr_salt
+        self.hash = curr_hash
+        if Util.needs_rehash(curr_hash):
+            try:
+                self.rehash()
+            except DatabaseError:
+                # the old hash still works; the upgrade is retried on the next login
+                pass
+        return self
+
+    # re-hash a verified password with the configured algorithm and work factor
+    def rehash(self):
+        salt = Util.generate_salt()
+        hash = Util.generate_hash(self.password, salt)
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        update_hash = "UPDATE Patients SET Salt = %s, Hash = %s WHERE Username = %s"
+        try:
+            cursor.execute(update_hash, (salt, hash, self.username))
+            conn.commit()
+        finally:
+            cm.close_connection()
+        self.salt = salt
+        self.hash = hash
+        credential_cache.store("Patients", self.username, salt, hash)
+
+    def get_apptID(self):
+        return self.apptID
+
+    def get_username(self):
+        return self.username
+
+    def get_salt(self):
+        return self.salt
+
+    def get_hash(self):
+        return self.hash
+
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        # VALUES: Username, salt, hash,  apptID
+        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s, NULL)"
+        try:
+            cursor.execute(add_patients, (self.username, self.salt, self.hash))
+            # TODO you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        # also forgets that the name was unknown, so the new user can log in right away
+        credential_cache.store("Patients", self.username, self.salt, self.hash)
+
+    # bulk loaders for admin tooling: patients with their stored credentials and appointment
+    # ID (no password), fetched a batch at a time and yielded one by one
+    @classmethod
+    def load_many(cls, usernames, batch_size=1000):
+        for row in load_rows("Patients", ("Username", "Salt", "Hash", "apptID"), "Username", usernames, batch_size):
+            yield cls._from_row(row)
+
+    @classmethod
+    def iter_all(cls, batch_size=1000):
+        for row in iter_rows("Patients", ("Username", "Salt", "Hash", "apptID"), "Username", batch_size):
+            yield cls._from_row(row)
+
+    @classmethod
+    def _from_row(cls, row):
+        patient = cls(row[0], salt=row[1], hash=row[2])
+        patient.apptID = row[3]
+        return patient
+
+    # async versions, for handlers running on an event loop; the work itself runs on async_db's threads
+    async def get_async(self):
+        return await async_db.run(self.get)
+
+    async def save_to_db_async(self):
+        return await async_db.run(self.save_to_db)
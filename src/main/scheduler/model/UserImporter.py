@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+from util.Util import Util, process_pool
+from db.ConnectionManager import ConnectionManager
+from db.StorageBackend import DatabaseError
+from db.RecordLoader import load_rows
+from model.CredentialCache import credential_cache
+
+
+class UserImporter:
+    """
+    Creates patient or caregiver accounts in bulk from a CSV file of username,password rows
+    (an optional header row is skipped) or a JSONL file of {"username": ..., "password": ...}
+    objects (by the .jsonl / .json extension).
+
+    Usernames and passwords are lowercased, as create_patient / create_caregiver store them,
+    so imported users log in the same way as users created by hand.
+
+    Users are handled chunk_size at a time: one IN (...) query finds the usernames that
+    already exist, the new users' passwords are hashed in parallel across worker processes
+    (at most MAX_WORKERS), and the chunk is inserted with multi-row statements in one
+    transaction.
+    Existing usernames, repeats within the file and users another session creates first
+    are skipped; malformed rows, and chunks the database rejects, are counted as failed.
+    """
+
+    # failures listed in the summary; the counts include all of them
+    MAX_ERRORS = 10
+    # hashing processes, whatever the CPU count or --workers
+    MAX_WORKERS = 8
+
+    def __init__(self, table, chunk_size=1000, workers=None):
+        self.table = table
+        self.chunk_size = chunk_size
+        self.workers = min(workers if workers is not None else (os.cpu_count() or 1), self.MAX_WORKERS)
+        self.created = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, path):
+        """Import every user in the file at path; returns (created, skipped, failed)."""
+        executor = None
+        if self.workers > 1:
+            executor = process_pool(self.workers)
+        try:
+            seen = set()
+            chunk = []
+            for line, username, password in self._read(path):
+                if username in seen:
+                    self.skipped += 1
+                    continue
+                seen.add(username)
+                chunk.append((line, username, password))
+                if len(chunk) == self.chunk_size:
+                    self._import_chunk(chunk, executor)
+                    chunk = []
+            if chunk:
+                self._import_chunk(chunk, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self.created, self.skipped, self.failed
+
+    def _read(self, path):
+        # (line number, username, password) for each valid row; invalid ones are counted here
+        with open(path, newline="") as f:
+            if path.lower().endswith((".jsonl", ".json")):
+                for line, text in enumerate(f, 1):
+                    if not text.strip():
+                        continue
+                    try:
+                        record = json.loads(text)
+                        username, password = record.get("username"), record.get("password")
+                    except (ValueError, AttributeError):
+                        self._fail(line, "not a JSON object")
+                        continue
+                    if self._valid(line, username, password):
+                        yield line, username.lower(), password.lower()
+                return
+            reader = csv.reader(f)
+            for row in reader:
+                if not row or not "".join(row).strip():
+                    continue
+                if reader.line_num == 1 and [c.strip().lower() for c in row[:2]] == ["username", "password"]:
+                    continue
+                username = row[0].strip()
+                password = row[1] if len(row) > 1 else None
+                if self._valid(reader.line_num, username, password):
+                    yield reader.line_num, username.lower(), password.lower()
+
+    def _valid(self, line, username, password):
+        # the same usernames and passwords create_patient / create_caregiver accept: one token
+        # each (anything else could never be typed at login), usernames at most 255 characters
+        if not isinstance(username, str) or not username or len(username.split()) != 1 or len(username) > 255:
+            self._fail(line, "invalid username")
+            return False
+        if not isinstance(password, str) or not password:
+            self._fail(line, "missing password")
+            return False
+        if len(password.split()) != 1 or password != password.strip():
+            self._fail(line, "invalid password")
+            return False
+        return True
+
+    def _import_chunk(self, chunk, executor):
+        existing = {row[0] for row in load_rows(self.table, ("Username",), "Username", [u for _, u, _ in chunk])}
+        new = [(username, password) for _, username, password in chunk if username not in existing]
+        self.skipped += len(chunk) - len(new)
+        if not new:
+            return
+
+        # hashed before a connection is taken, so the slow part holds no locks
+        salts = [Util.generate_salt() for _ in new]
+        hashes = Util.generate_hashes([(password, salt) for (_, password), salt in zip(new, salts)], executor)
+        rows = [(username, salt, hash) for (username, _), salt, hash in zip(new, salts, hashes)]
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        try:
+            conn.begin()
+            inserted = cm.backend.insert_new_rows(cursor, self.table, ("Username", "Salt", "Hash"), ("Username",),
+                                                  rows)
+            conn.commit()
+        except DatabaseError as e:
+            conn.rollback()
+            self._fail(chunk[0][0], f"Db-Error: {e} ({len(rows)} users not created)", len(rows))
+            return
+        finally:
+            cm.close_connection()
+
+        self.created += inserted
+        self.skipped += len(rows) - inserted
+        for username, salt, hash in rows:
+            if inserted == len(rows):
+                credential_cache.store(self.table, username, salt, hash)
+            else:
+                # some were created by another session first; which ones is read back on demand
+                credential_cache.invalidate(self.table, username)
+
+    def _fail(self, line, message, count=1):
+        self.failed += count
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((line, message))
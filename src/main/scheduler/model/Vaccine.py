@@ -1,99 +1,119 @@
-import sys
-sys.path.append("../db/*")
-from db.ConnectionManager import ConnectionManager
-import pymssql
-
-
-class Vaccine:
-    def __init__(self, vaccine_name, available_doses):
-        self.vaccine_name = vaccine_name
-        self.available_doses = available_doses
-
-    # getters
-    def get(self):
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
-        try:
-            cursor.execute(get_vaccine, self.vaccine_name)
-            for row in cursor:
-                self.available_doses = row[1]
-                return self
-        except pymssql.Error:
-            # print("Error occurred when getting Vaccine")
-            raise
-        finally:
-            cm.close_connection()
-        return None
-
-    def get_vaccine_name(self):
-        return self.vaccine_name
-
-    def get_available_doses(self):
-        return self.available_doses
-
-    def save_to_db(self):
-        if self.available_doses is None or self.available_doses <= 0:
-            raise ValueError("Argument cannot be negative!")
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
-        try:
-            cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when insert Vaccines")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Increment the available doses
-    def increase_available_doses(self, num):
-        if num <= 0:
-            raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
-
-    # Decrement the available doses
-    def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
-
-    def __str__(self):
-        return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
+from db.ConnectionManager import ConnectionManager
+from db.AsyncDatabase import async_db
+from model.VaccineCache import vaccine_cache
+from db.StorageBackend import DatabaseError
+from db.DoseLedger import dose_ledger, available_query
+
+
+class Vaccine:
+    __slots__ = ("vaccine_name", "available_doses")
+
+    def __init__(self, vaccine_name, available_doses):
+        self.vaccine_name = vaccine_name
+        self.available_doses = available_doses
+
+    # getters
+    def get(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        get_vaccine = available_query(by_name=True)
+        try:
+            cursor.execute(get_vaccine, self.vaccine_name)
+            for row in cursor:
+                self.available_doses = row[1]
+                return self
+        except DatabaseError:
+            # print("Error occurred when getting Vaccine")
+            raise
+        finally:
+            cm.close_connection()
+        return None
+
+    def get_vaccine_name(self):
+        return self.vaccine_name
+
+    def get_available_doses(self):
+        return self.available_doses
+
+    def save_to_db(self):
+        if self.available_doses is None or self.available_doses <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        # the balance starts at 0; the doses arrive through the ledger like any later ones
+        add_vaccine = "INSERT INTO Vaccines (Name, Doses) VALUES (%s, 0)"
+        try:
+            conn.begin()
+            cursor.execute(add_vaccine, self.vaccine_name)
+            dose_ledger.add_vaccine(cursor, self.vaccine_name)
+            dose_ledger.credit(cursor, self.vaccine_name, self.available_doses, "add")
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+            vaccine_cache.set_doses(self.vaccine_name, self.available_doses)
+        except DatabaseError:
+            # print("Error occurred when insert Vaccines")
+            raise
+        finally:
+            cm.close_connection()
+
+    # Increment the available doses
+    def increase_available_doses(self, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        # a relative change through the ledger, so doses added or booked meanwhile are kept
+        try:
+            dose_ledger.credit(cursor, self.vaccine_name, num, "add")
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+            self.available_doses += num
+            vaccine_cache.adjust(self.vaccine_name, num)
+        except DatabaseError:
+            # print("Error occurred when updating vaccine availability")
+            raise
+        finally:
+            cm.close_connection()
+
+    # Decrement the available doses
+    def decrease_available_doses(self, num):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        try:
+            conn.begin()
+            if not dose_ledger.debit(cursor, self.vaccine_name, num, "remove"):
+                conn.rollback()
+                raise ValueError("Not enough available doses!")
+            cursor.execute(available_query(by_name=True), self.vaccine_name)
+            self.available_doses = cursor.fetchone()[1]
+            # you must call commit() to persist your data if you don't set autocommit to True
+            conn.commit()
+            vaccine_cache.set_doses(self.vaccine_name, self.available_doses)
+        except DatabaseError:
+            # print("Error occurred when updating vaccine availability")
+            raise
+        finally:
+            cm.close_connection()
+
+    def __str__(self):
+        return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
+
+    # async versions, for handlers running on an event loop; the work itself runs on async_db's threads
+    async def get_async(self):
+        return await async_db.run(self.get)
+
+    async def save_to_db_async(self):
+        return await async_db.run(self.save_to_db)
+
+    async def increase_available_doses_async(self, num):
+        return await async_db.run(self.increase_available_doses, num)
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from db.ConnectionManager import ConnectionManager
+from db.DoseLedger import available_query
+
+
+class VaccineCache:
+    """
+    In-process copy of every vaccine's available doses (name -> doses, see DoseLedger).
+
+    The whole table is loaded in one query and served from memory until it is
+    ttl seconds old. Writes made by this process go through set_doses/adjust so
+    the copy stays current; changes made by other processes show up once the
+    TTL expires. Reads are a hint only: the booking transaction still checks
+    stock against the database before taking a dose.
+    """
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._doses = None
+        self._loaded_at = 0.0
+
+    def inventory(self):
+        with self._lock:
+            if self._doses is None or time.monotonic() - self._loaded_at > self.ttl:
+                self.misses += 1
+                self._load()
+            else:
+                self.hits += 1
+            return dict(self._doses)
+
+    def get_doses(self, vaccine_name):
+        # None if there is no such vaccine
+        return self.inventory().get(vaccine_name)
+
+    def is_valid(self, vaccine_name):
+        return self.get_doses(vaccine_name) is not None
+
+    def set_doses(self, vaccine_name, doses):
+        with self._lock:
+            if self._doses is not None:
+                self._doses[vaccine_name] = doses
+
+    def adjust(self, vaccine_name, delta):
+        with self._lock:
+            if self._doses is not None and vaccine_name in self._doses:
+                self._doses[vaccine_name] = max(0, self._doses[vaccine_name] + delta)
+
+    def invalidate(self):
+        with self._lock:
+            self._doses = None
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _load(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor(as_dict=True)
+        try:
+            cursor.execute(available_query())
+            self._doses = {row['Name']: row['Doses'] for row in cursor.fetchall()}
+            self._loaded_at = time.monotonic()
+        finally:
+            cm.close_connection()
+
+
+vaccine_cache = VaccineCache(ttl=float(os.getenv("VaccineCacheTTL", "30")))
@@ -0,0 +1,232 @@
+"""
+Utilization, dose burn-down and cancellation reports for operations staff.
+
+Each report is built from a few set-based queries whose results are pulled in bulk as
+columns, so the database does the per-slot work and Python never sees one row per slot.
+Derived columns (open slots, rates, running stock) are computed on whole columns with
+numpy when it is installed; without it the same results come from plain lists.
+"""
+import csv
+import datetime
+import json
+from db.ConnectionManager import ConnectionManager
+from db.DoseLedger import available_query
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Report:
+    """A report's rows as named columns, in output order, plus totals over all rows."""
+
+    def __init__(self, name, columns, totals=None):
+        self.name = name
+        self.columns = columns
+        self.totals = totals or {}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def rows(self):
+        # one tuple of plain Python values per row
+        return zip(*(_values(column) for column in self.columns.values()))
+
+    def write(self, f, output_format="csv"):
+        if output_format == "json":
+            self.write_json(f)
+        else:
+            self.write_csv(f)
+
+    def write_csv(self, f):
+        writer = csv.writer(f)
+        writer.writerow(self.columns)
+        writer.writerows(self.rows())
+
+    def write_json(self, f):
+        names = list(self.columns)
+        json.dump({"report": self.name, "totals": self.totals,
+                   "rows": [dict(zip(names, row)) for row in self.rows()]}, f, default=_json_value)
+        f.write("\n")
+
+
+def utilization(start=None, end=None):
+    # booked and open slots per day and caregiver
+    conditions, params = _date_range("Time", start, end)
+    data = _load("SELECT Time, Username, COUNT(*), COUNT(apptID) FROM Availabilities" + _where(conditions) +
+                 " GROUP BY Time, Username ORDER BY Time, Username;", params,
+                 ("Date", "Caregiver", "Slots", "Booked"))
+    slots = _array(data["Slots"])
+    booked = _array(data["Booked"])
+    open_slots = _subtract(slots, booked)
+    total_slots, total_booked = _sum(slots), _sum(booked)
+    return Report("utilization", {"Date": data["Date"], "Caregiver": data["Caregiver"], "Slots": slots,
+                                  "Booked": booked, "Open": open_slots, "Utilization": _ratio(booked, slots)},
+                  {"slots": total_slots, "booked": total_booked, "open": total_slots - total_booked,
+                   "utilization": round(total_booked / total_slots, 4) if total_slots else 0.0})
+
+
+def burndown(start=None, end=None):
+    # per vaccine and day: doses scheduled that day, and doses left once that day's
+    # appointments and every earlier one are given (available doses plus later bookings)
+    conditions, params = _date_range("Time", start, None)
+    data = _load("SELECT Name, Time, COUNT(*) FROM Availabilities" + _where(["apptID IS NOT NULL"] + conditions) +
+                 " GROUP BY Name, Time ORDER BY Name, Time;", params,
+                 ("Vaccine", "Date", "Scheduled"))
+    available = dict(zip(*_load(available_query(), None, ("Vaccine", "Doses")).values()))
+
+    vaccines, dates, scheduled = data["Vaccine"], data["Date"], _array(data["Scheduled"])
+    firsts, lasts = _runs(vaccines)
+    if np is not None:
+        lengths = np.subtract(lasts, firsts).astype(np.int64)
+        # doses booked from each row to the end of its vaccine's run
+        from_here = np.cumsum(scheduled[::-1])[::-1]
+        run_end = np.append(from_here, 0)[np.repeat(np.asarray(lasts, dtype=np.int64), lengths)]
+        stock = np.repeat(_array([available.get(vaccines[i], 0) for i in firsts]), lengths)
+        remaining = stock + from_here - run_end - scheduled
+    else:
+        remaining = []
+        for first, last in zip(firsts, lasts):
+            left = available.get(vaccines[first], 0)
+            later = []
+            for n in reversed(scheduled[first:last]):
+                later.append(left)
+                left += n
+            remaining.extend(reversed(later))
+
+    totals = {vaccines[first]: {"available": available.get(vaccines[first], 0),
+                                "scheduled": _sum(scheduled[first:last])}
+              for first, last in zip(firsts, lasts)}
+    report = Report("burndown", {"Vaccine": vaccines, "Date": dates, "Scheduled": scheduled, "Remaining": remaining},
+                    totals)
+    if end is not None:
+        # later bookings still count towards Remaining, so the end date only trims the output
+        if np is not None:
+            keep = np.asarray(dates, dtype="datetime64[D]") <= np.datetime64(end)
+        else:
+            keep = [d <= end for d in dates]
+        report.columns = {name: _select(column, keep) for name, column in report.columns.items()}
+    return report
+
+
+def cancellations(start=None, end=None):
+    # per vaccine: appointments still booked, cancellations by who cancelled, and the share
+    # of all appointments made that were cancelled
+    conditions, params = _date_range("Time", start, end)
+    booked = _load("SELECT Name, COUNT(*) FROM Availabilities" + _where(["apptID IS NOT NULL"] + conditions) +
+                   " GROUP BY Name;", params, ("Vaccine", "Booked"))
+    cancelled = _load("SELECT Name, CancelledBy, COUNT(*) FROM Cancellations" + _where(conditions) +
+                      " GROUP BY Name, CancelledBy;", params, ("Vaccine", "CancelledBy", "Cancelled"))
+
+    counts = {}
+    for vaccine, n in zip(booked["Vaccine"], booked["Booked"]):
+        counts.setdefault(vaccine, {})["booked"] = n
+    for vaccine, by, n in zip(cancelled["Vaccine"], cancelled["CancelledBy"], cancelled["Cancelled"]):
+        counts.setdefault(vaccine, {})[by] = n
+    vaccines = sorted(counts)
+    still_booked = _array([counts[v].get("booked", 0) for v in vaccines])
+    by_patient = _array([counts[v].get("patient", 0) for v in vaccines])
+    by_caregiver = _array([counts[v].get("caregiver", 0) for v in vaccines])
+    total_cancelled = _add(by_patient, by_caregiver)
+    made = _add(still_booked, total_cancelled)
+    return Report("cancellations", {"Vaccine": vaccines, "Booked": still_booked, "CancelledByPatient": by_patient,
+                                    "CancelledByCaregiver": by_caregiver, "Cancelled": total_cancelled,
+                                    "CancellationRate": _ratio(total_cancelled, made)},
+                  {"booked": _sum(still_booked), "cancelled": _sum(total_cancelled),
+                   "cancellation_rate": round(_sum(total_cancelled) / _sum(made), 4) if _sum(made) else 0.0})
+
+
+REPORTS = {
+    "utilization": utilization,
+    "burndown": burndown,
+    "cancellations": cancellations,
+}
+
+
+def _load(query, params, names):
+    # one query's result as {name: list of values}, fetched in large batches
+    columns = [[] for _ in names]
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.extend(values)
+    finally:
+        cm.close_connection()
+    return dict(zip(names, columns))
+
+
+def _date_range(column, start, end):
+    conditions = []
+    params = ()
+    if start is not None:
+        conditions.append(f"{column} >= %s")
+        params += (start,)
+    if end is not None:
+        conditions.append(f"{column} <= %s")
+        params += (end,)
+    return conditions, params or None
+
+
+def _where(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def _runs(keys):
+    # keys is sorted, so equal keys are one run; returns the runs' [first, last) row numbers
+    if not len(keys):
+        return [], []
+    if np is not None:
+        keys = np.asarray(keys, dtype=object)
+        firsts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        return firsts.tolist(), np.append(firsts[1:], len(keys)).tolist()
+    firsts = [i for i in range(len(keys)) if i == 0 or keys[i] != keys[i - 1]]
+    return firsts, firsts[1:] + [len(keys)]
+
+
+# column arithmetic on numpy arrays when numpy is available, on lists otherwise
+
+def _array(values):
+    return np.asarray(values, dtype=np.int64) if np is not None else list(values)
+
+
+def _add(a, b):
+    return a + b if np is not None else [x + y for x, y in zip(a, b)]
+
+
+def _subtract(a, b):
+    return a - b if np is not None else [x - y for x, y in zip(a, b)]
+
+
+def _sum(a):
+    return int(np.sum(a)) if np is not None else sum(a)
+
+
+def _ratio(a, b):
+    # a / b to 4 places, 0 where b is 0
+    if np is not None:
+        return np.round(np.divide(a, b, out=np.zeros(len(a)), where=b != 0), 4)
+    return [round(x / y, 4) if y else 0.0 for x, y in zip(a, b)]
+
+
+def _select(column, keep):
+    if np is not None and isinstance(column, np.ndarray):
+        return column[np.asarray(keep, dtype=bool)]
+    return [value for value, k in zip(column, keep) if k]
+
+
+def _values(column):
+    return column.tolist() if np is not None and isinstance(column, np.ndarray) else column
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
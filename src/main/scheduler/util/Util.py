@@ -1,23 +1,176 @@
+import base64
+import datetime
 import hashlib
+import hmac
 import os
-from random import randint
+import threading
+
+
+# Hashes are stored as b"$1$<algorithm>$<k=v,...>$<base64 key>". A bare 16-byte value is
+# the original format: PBKDF2-SHA256, 100,000 iterations, 16-byte key.
+HASH_VERSION = "1"
+LEGACY_PARAMS = ("pbkdf2_sha256", {"i": 100000, "l": 16})
+
+
+def _hash_settings():
+    algorithm = os.getenv("HashAlgorithm", "pbkdf2_sha256")
+    if algorithm == "pbkdf2_sha256":
+        return algorithm, {"i": int(os.getenv("HashIterations", "100000")), "l": 16}
+    if algorithm == "scrypt":
+        return algorithm, {"n": int(os.getenv("ScryptN", "16384")), "r": int(os.getenv("ScryptR", "8")),
+                           "p": int(os.getenv("ScryptP", "1")), "l": 16}
+    raise ValueError(f"Unsupported HashAlgorithm: {algorithm}")
+
+
+def _derive(password, salt, algorithm, params):
+    # module level so it can run in a worker process
+    if algorithm == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params["i"], dklen=params["l"])
+    if algorithm == "scrypt":
+        n = params["n"]
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=params["r"], p=params["p"],
+                              dklen=params["l"], maxmem=2 * 128 * n * params["r"] + 1024 * 1024)
+    raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+
+
+def _encode_hash(algorithm, params, key):
+    param_text = ",".join(f"{k}={v}" for k, v in params.items())
+    return f"${HASH_VERSION}${algorithm}${param_text}$".encode("ascii") + base64.b64encode(key)
+
+
+def _decode_hash(stored):
+    # a legacy key is random bytes, so about 1 in 256 also starts with "$"; anything that is
+    # 16 bytes long or does not parse as the current format is taken to be legacy
+    stored = bytes(stored)
+    if len(stored) == 16 or not stored.startswith(f"${HASH_VERSION}$".encode("ascii")):
+        return LEGACY_PARAMS[0], LEGACY_PARAMS[1], stored
+    try:
+        _, version, algorithm, param_text, key = stored.decode("ascii").split("$")
+        params = {k: int(v) for k, v in (item.split("=") for item in param_text.split(","))}
+        return algorithm, params, base64.b64decode(key, validate=True)
+    except ValueError:
+        # UnicodeDecodeError and binascii.Error are both ValueErrors
+        return LEGACY_PARAMS[0], LEGACY_PARAMS[1], stored
+
+
+def _hash_worker(password, salt, algorithm, params):
+    return _encode_hash(algorithm, params, _derive(password, salt, algorithm, params))
+
+
+def _verify_worker(password, salt, stored):
+    algorithm, params, key = _decode_hash(stored)
+    return hmac.compare_digest(_derive(password, salt, algorithm, params), key)
+
+
+_settings = None
+_workers = None
+_pool = None
+_pool_lock = threading.Lock()
+_dummy = None
+
+
+def _current_settings():
+    global _settings
+    if _settings is None:
+        _settings = _hash_settings()
+    return _settings
+
+
+def _hash_pool():
+    # HashWorkers > 0 moves key derivation into that many worker processes so hashes for
+    # concurrent sessions are computed in parallel instead of one at a time under the GIL
+    global _pool, _workers
+    if _workers is None:
+        _workers = int(os.getenv("HashWorkers", "0"))
+    if _workers <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = process_pool(_workers)
+    return _pool
+
+
+def process_pool(workers):
+    # worker processes are started from a fresh interpreter (forkserver, or spawn where there
+    # is none), never forked: the pool may be created from a server or AsyncDatabase thread,
+    # and a fork copies locks other threads hold, which the child can then never take
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
 
 class Util:
     def generate_salt():
         return os.urandom(16)
 
+    # hash with the configured algorithm and work factor (HashAlgorithm, HashIterations, Scrypt*)
     def generate_hash(password, salt):
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000,
-            dklen=16
-        )
-        return key
+        algorithm, params = _current_settings()
+        pool = _hash_pool()
+        if pool is None:
+            return _hash_worker(password, salt, algorithm, params)
+        return pool.submit(_hash_worker, password, salt, algorithm, params).result()
+
+    # hash many (password, salt) pairs, spread across the processes of executor (default: the
+    # HashWorkers pool) if there are any; sent in chunks so each process gets a share of the work
+    @staticmethod
+    def generate_hashes(pairs, executor=None):
+        algorithm, params = _current_settings()
+        pool = executor if executor is not None else _hash_pool()
+        if pool is None:
+            return [_hash_worker(password, salt, algorithm, params) for password, salt in pairs]
+        n = len(pairs)
+        chunksize = max(1, n // (4 * (os.cpu_count() or 1)))
+        return list(pool.map(_hash_worker, [password for password, _ in pairs], [salt for _, salt in pairs],
+                             [algorithm] * n, [params] * n, chunksize=chunksize))
+
+    # check a password against a stored hash in either the current or the legacy format
+    @staticmethod
+    def verify_hash(password, salt, stored):
+        pool = _hash_pool()
+        if pool is None:
+            return _verify_worker(password, salt, stored)
+        return pool.submit(_verify_worker, password, salt, stored).result()
+
+    # the same work as checking a wrong password, for logins with an unknown username, so the
+    # response time does not tell which usernames exist
+    @staticmethod
+    def verify_dummy(password):
+        global _dummy
+        if _dummy is None:
+            salt = Util.generate_salt()
+            _dummy = (salt, Util.generate_hash(os.urandom(16).hex(), salt))
+        Util.verify_hash(password, *_dummy)
+
+    # true if the stored hash was made with other settings than the configured ones
+    @staticmethod
+    def needs_rehash(stored):
+        algorithm, params, _ = _decode_hash(stored)
+        return (algorithm, params) != _current_settings()
+
+    # parse a hyphenated MM-DD-YYYY date; raises ValueError if it is malformed
+    @staticmethod
+    def parse_date(date):
+        date_tokens = date.strip().split("-")
+        if len(date_tokens) != 3:
+            raise ValueError(f"Invalid date: {date}")
+        month = int(date_tokens[0])
+        day = int(date_tokens[1])
+        year = int(date_tokens[2])
+        return datetime.date(year, month, day)
+
+    # parse an HH:MM time of day into minutes after midnight; raises ValueError if it is malformed
+    @staticmethod
+    def parse_time(time):
+        time_tokens = time.strip().split(":")
+        if len(time_tokens) != 2:
+            raise ValueError(f"Invalid time: {time}")
+        t = datetime.time(int(time_tokens[0]), int(time_tokens[1]))
+        return t.hour * 60 + t.minute
 
+    # minutes after midnight as HH:MM
     @staticmethod
-    def generate_apptID(n=8):
-        range_start = 10 ** (n - 1)
-        range_end = (10 ** n) - 1
-        return str(randint(range_start, range_end))
\ No newline at end of file
+    def format_time(minutes):
+        return f"{minutes // 60:02d}:{minutes % 60:02d}"